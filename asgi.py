@@ -0,0 +1,346 @@
+"""ASGI serving mode with non-blocking Gemini and database I/O.
+
+The chat, fertility prediction and nutrient extraction endpoints run natively
+async: Gemini calls go through the SDK's async client (``client.aio``), chat
+history through AsyncChatDatabase, and model inference through a bounded thread
+pool, so in-flight Gemini calls no longer pin a thread each. All other routes are
+served by the Flask app from create_app on a WSGI thread pool.
+
+Usage:
+    uvicorn asgi:create_asgi_app --factory --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import io
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from PIL import Image
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from app import (
+    NUTRIENT_FIELDS,
+    create_app,
+    fertility_verification_failed,
+    fertility_verification_prompt,
+    make_chat_turn,
+    nutrient_extraction_prompt,
+    parse_extracted_nutrients,
+    parse_fertility_verification,
+    validate_nutrients,
+)
+from chat_database import AsyncChatDatabase
+from metrics import IN_FLIGHT, observe_request
+from prediction_cache import nutrient_cache_key
+from verification_jobs import JobQueueFull
+
+logger = logging.getLogger(__name__)
+
+
+def create_asgi_app(gemini_client=None):
+    flask_app = create_app(gemini_client)
+    services = flask_app.extensions["agrisoil"]
+    gemini_client = services.gemini_client
+    gemini_available = services.gemini_available
+    cached_gemini_client = services.cached_gemini_client
+    quality_classifier = services.quality_classifier
+    prediction_cache = services.prediction_cache
+    chat_db = AsyncChatDatabase(services.chat_db, max_workers=int(os.environ.get("DB_WORKERS", 4)))
+
+    # CPU-bound model calls share a bounded pool so a burst of requests cannot oversubscribe the cores
+    inference_executor = ThreadPoolExecutor(
+        max_workers=int(os.environ.get("INFERENCE_WORKERS", os.cpu_count() or 4)),
+        thread_name_prefix="inference",
+    )
+
+    async def run_inference(fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(inference_executor, fn, *args)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        # Load the (lazy) Gemini client off the event loop before traffic arrives; a
+        # client that fails to load leaves the Gemini endpoints answering 503
+        await asyncio.to_thread(gemini_available)
+        yield
+
+    async def read_chat_turn(request):
+        """Async counterpart of the Flask parse_chat_request: (turn, None) or (None, error message)"""
+        if "multipart/form-data" in request.headers.get("content-type", ""):
+            form = await request.form()
+            image_file = form.get("image")
+            image_bytes = await image_file.read() if hasattr(image_file, "read") else None
+            return make_chat_turn(
+                form.get("session_id"),
+                form.get("message", ""),
+                form.get("language", "en"),
+                image_bytes=image_bytes,
+                multipart=True
+            )
+        data = await request.json()
+        return make_chat_turn(data.get("session_id"), data.get("message"), data.get("language", "en"))
+
+    async def chat_message(request):
+        """Async /chat/message"""
+        if not await asyncio.to_thread(gemini_available):
+            return JSONResponse({"error": "Chatbot service not available. Please set GEMINI_API_KEY."}, 503)
+
+        try:
+            turn, error = await read_chat_turn(request)
+            if error:
+                return JSONResponse({"error": error}, 400)
+            session_id = turn["session_id"]
+
+            await chat_db.add_message(session_id, "user", turn["user_message"])
+            # Runs in a thread: reads the database (summary updates run in the background)
+            contents = await asyncio.to_thread(services.chat_context.build, turn)
+
+            response = await gemini_client.aio.models.generate_content(
+                model="gemini-2.5-flash",
+                contents=contents
+            )
+            ai_message = response.text
+
+            action = await run_inference(services.run_chat_action, ai_message)
+            if action:
+                return JSONResponse({
+                    "message": action["message"],
+                    "session_id": session_id,
+                    "tool_result": action["tool_result"]
+                })
+
+            await chat_db.add_message(session_id, "assistant", ai_message)
+            return JSONResponse({"message": ai_message, "session_id": session_id})
+
+        except Exception as e:
+            return JSONResponse({"error": str(e)}, 500)
+
+    async def chat_message_stream(request):
+        """Async /chat/message/stream (same Server-Sent Events as the Flask endpoint)"""
+        if not await asyncio.to_thread(gemini_available):
+            return JSONResponse({"error": "Chatbot service not available. Please set GEMINI_API_KEY."}, 503)
+
+        try:
+            turn, error = await read_chat_turn(request)
+            if error:
+                return JSONResponse({"error": error}, 400)
+            session_id = turn["session_id"]
+            await chat_db.add_message(session_id, "user", turn["user_message"])
+            contents = await asyncio.to_thread(services.chat_context.build, turn)
+        except Exception as e:
+            return JSONResponse({"error": str(e)}, 500)
+
+        async def generate():
+            started = time.perf_counter()
+            first_token_ms = None
+            parts = []
+            try:
+                stream = await gemini_client.aio.models.generate_content_stream(
+                    model="gemini-2.5-flash",
+                    contents=contents
+                )
+                async for chunk in stream:
+                    text = chunk.text
+                    if not text:
+                        continue
+                    if first_token_ms is None:
+                        first_token_ms = round((time.perf_counter() - started) * 1000, 1)
+                    parts.append(text)
+                    yield "event: token\ndata: " + json.dumps({"text": text}) + "\n\n"
+
+                ai_message = "".join(parts)
+                done = {
+                    "message": ai_message,
+                    "session_id": session_id,
+                    "time_to_first_token_ms": first_token_ms,
+                    "total_ms": round((time.perf_counter() - started) * 1000, 1)
+                }
+                action = await run_inference(services.run_chat_action, ai_message)
+                if action:
+                    done.update(action)
+                else:
+                    await chat_db.add_message(session_id, "assistant", ai_message)
+                yield "event: done\ndata: " + json.dumps(done) + "\n\n"
+            except Exception as e:
+                yield "event: error\ndata: " + json.dumps({"error": str(e)}) + "\n\n"
+
+        return StreamingResponse(generate(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    async def verify_fertility(cache_key, data, prediction):
+        """Async counterpart of create_app's verify_fertility"""
+        ai_verification = None
+        if await asyncio.to_thread(gemini_available):
+            try:
+                response = await cached_gemini_client.aio.models.generate_content(
+                    model="gemini-2.5-flash",
+                    contents=fertility_verification_prompt(data, prediction)
+                )
+                ai_verification = parse_fertility_verification(response.text.strip())
+            except Exception as e:
+                ai_verification = fertility_verification_failed(e)
+
+        # Only cache complete answers: a transient Gemini failure, or Gemini being
+        # unavailable, is retried next time instead of being served for the whole TTL
+        if ai_verification is not None and "error" not in ai_verification:
+            await asyncio.to_thread(prediction_cache.set, cache_key, {
+                "prediction": prediction,
+                "ai_verification": ai_verification
+            })
+        return ai_verification
+
+    async def predict_fertility(request):
+        """Async /predict-fertility"""
+        if quality_classifier is None:
+            return JSONResponse({"status": "Error", "message": "Soil quality model not loaded"}, 500)
+
+        try:
+            try:
+                data = await request.json()
+            except json.JSONDecodeError:
+                data = None
+            if not data:
+                return JSONResponse({"status": "Error", "message": "No JSON data received"}, 400)
+
+            values, error = validate_nutrients(data)
+            if error:
+                return JSONResponse({"status": "Error", "message": error}, 400)
+            data.update(values)
+
+            models = services.serving_models()
+            cache_key = services.model_cache_key(nutrient_cache_key(values, NUTRIENT_FIELDS), models)
+            cached = await asyncio.to_thread(prediction_cache.get, cache_key)
+            if cached is not None:
+                return JSONResponse({
+                    "status": "Success",
+                    "ml_prediction": cached["prediction"],
+                    "prediction": cached["prediction"],
+                    "input_data": data,
+                    "ai_verification": cached["ai_verification"]
+                })
+
+            ml_result = await run_inference(models.fertility_model.compute_prediction, data)
+            if ml_result["status"] != "Success":
+                return JSONResponse(ml_result, 400)
+            prediction = ml_result["prediction"]
+
+            if request.query_params.get("async", "false").lower() in ("1", "true", "yes") and await asyncio.to_thread(gemini_available):
+                try:
+                    job_id = services.verification_jobs.submit(
+                        lambda: services.verify_fertility(cache_key, dict(data), prediction)
+                    )
+                except JobQueueFull as e:
+                    return JSONResponse({"status": "Error", "message": f"Verification queue is full, retry later: {e}"},
+                                        503, headers={"Retry-After": "5"})
+                return JSONResponse({
+                    "status": "Success",
+                    "ml_prediction": prediction,
+                    "prediction": prediction,
+                    "input_data": data,
+                    "ai_verification": None,
+                    "verification_job_id": job_id,
+                    "verification_status": "pending"
+                }, 202)
+
+            return JSONResponse({
+                "status": "Success",
+                "ml_prediction": prediction,
+                "prediction": prediction,
+                "input_data": data,
+                "ai_verification": await verify_fertility(cache_key, data, prediction)
+            })
+
+        except Exception as e:
+            logger.exception("predict_fertility failed")
+            return JSONResponse({"status": "Error", "message": str(e)}, 500)
+
+    async def extract_nutrients(request):
+        """Async /extract-nutrients"""
+        if not await asyncio.to_thread(gemini_available):
+            return JSONResponse({"status": "Error", "message": "Gemini AI service not available. Please set GEMINI_API_KEY."}, 503)
+
+        try:
+            form = await request.form()
+            file = form.get("file")
+            if not hasattr(file, "read"):
+                return JSONResponse({"status": "Error", "message": "No file uploaded"}, 400)
+            if file.filename == "":
+                return JSONResponse({"status": "Error", "message": "No file selected"}, 400)
+
+            try:
+                image = Image.open(io.BytesIO(await file.read()))
+            except Exception as e:
+                return JSONResponse({"status": "Error", "message": f"Failed to process image: {str(e)}"}, 400)
+
+            response = await cached_gemini_client.aio.models.generate_content(
+                model="gemini-2.5-flash",
+                contents=[nutrient_extraction_prompt(form.get("language", "en")), image]
+            )
+            final_nutrients = parse_extracted_nutrients(response.text.strip())
+
+            return JSONResponse({
+                "status": "Success",
+                "nutrients": final_nutrients,
+                "message": "Nutrients extracted successfully from lab report"
+            })
+
+        except Exception as e:
+            logger.exception("extract-nutrients failed")
+            return JSONResponse({"status": "Error", "message": str(e)}, 500)
+
+    native_app = Starlette(
+        routes=[
+            Route("/chat/message", chat_message, methods=["POST"]),
+            Route("/chat/message/stream", chat_message_stream, methods=["POST"]),
+            Route("/predict-fertility", predict_fertility, methods=["POST"]),
+            Route("/extract-nutrients", extract_nutrients, methods=["POST"]),
+        ],
+        # Same open CORS policy as flask_cors.CORS(app)
+        middleware=[Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])],
+        lifespan=lifespan,
+    )
+    native_paths = {route.path for route in native_app.routes}
+    wsgi_app = WSGIMiddleware(flask_app, workers=int(os.environ.get("WSGI_WORKERS", 16)))
+
+    async def instrumented_native_app(scope, receive, send):
+        """Record the same request metrics for the native routes as instrument_flask does for Flask"""
+        route = scope["path"]
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        IN_FLIGHT.inc(route=route)
+        try:
+            await native_app(scope, receive, send_with_status)
+        finally:
+            IN_FLIGHT.dec(route=route)
+            observe_request(route, scope["method"], status, time.perf_counter() - started)
+
+    async def app(scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in native_paths:
+            await instrumented_native_app(scope, receive, send)
+        elif scope["type"] != "http":
+            await native_app(scope, receive, send)
+        else:
+            await wsgi_app(scope, receive, send)
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run("asgi:create_asgi_app", factory=True, host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
@@ -0,0 +1,108 @@
+import threading
+import time
+from concurrent.futures import Future
+from queue import Queue, Empty
+from typing import Callable, Optional
+
+import numpy as np
+
+
+class BatchPredictor:
+    """Collects concurrent inference requests and runs them as one batched forward pass.
+
+    Callers submit their own input tensor (with a leading batch dimension) and block
+    until a background worker has gathered up to ``max_batch_size`` rows, or waited
+    ``max_wait_ms`` for more to arrive, and run ``predict_fn`` on the stacked batch.
+    Each caller gets back only the rows of the output that belong to its input.
+
+    A caller may pass a ``context`` (e.g. the model version it started on). Inputs with
+    different contexts are never batched together, and ``predict_fn`` receives the
+    batch's context as its second argument.
+    """
+
+    def __init__(self, predict_fn: Callable[[np.ndarray], np.ndarray],
+                 max_batch_size: int = 16, max_wait_ms: float = 5.0):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue = Queue()
+        self._pending = None
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="batch-predictor", daemon=True)
+        self._worker.start()
+
+    def predict(self, input_tensor: np.ndarray, timeout: Optional[float] = None, context=None) -> np.ndarray:
+        """Queue an input of shape (n, ...) and return its (n, ...) slice of the batched output"""
+        if self._closed:
+            raise RuntimeError("BatchPredictor has been closed")
+        future = Future()
+        self._queue.put((input_tensor, future, context))
+        return future.result(timeout)
+
+    def close(self):
+        """Stop the worker thread after it drains the requests already queued"""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._worker.join()
+
+    def _next_item(self, timeout: Optional[float]):
+        if self._pending is not None:
+            item, self._pending = self._pending, None
+            return item
+        if timeout is None:
+            return self._queue.get()
+        return self._queue.get(timeout=timeout)
+
+    def _run(self):
+        while True:
+            item = self._next_item(None)
+            if item is None:
+                return
+
+            batch = [item]
+            rows = len(item[0])
+            deadline = time.monotonic() + self.max_wait
+            stop = False
+            while rows < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._next_item(remaining)
+                except Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                if rows + len(item[0]) > self.max_batch_size or item[2] is not batch[0][2]:
+                    # Keep oversized arrivals, or ones for another context, for the next batch
+                    self._pending = item
+                    break
+                batch.append(item)
+                rows += len(item[0])
+
+            self._run_batch(batch)
+            if stop:
+                return
+
+    def _run_batch(self, batch):
+        try:
+            if len(batch) == 1:
+                inputs = batch[0][0]
+            else:
+                inputs = np.concatenate([tensor for tensor, _, _ in batch], axis=0)
+            context = batch[0][2]
+            outputs = np.asarray(self.predict_fn(inputs) if context is None else self.predict_fn(inputs, context))
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        offset = 0
+        for tensor, future, _ in batch:
+            count = len(tensor)
+            future.set_result(outputs[offset:offset + count])
+            offset += count
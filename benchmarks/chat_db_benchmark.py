@@ -0,0 +1,140 @@
+"""Concurrent-writer throughput of ChatDatabase versus earlier connection strategies.
+
+Compares the original connect-per-call pattern, one connection per thread, and the
+current shared pool. With --thread-per-request every message is written from a new
+thread, as a threaded WSGI server does it, which defeats per-thread connections.
+
+Usage:
+    python benchmarks/chat_db_benchmark.py --writers 8 --messages 500
+    python benchmarks/chat_db_benchmark.py --writers 8 --messages 500 --thread-per-request
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat_database import ChatDatabase
+
+
+class ConnectPerCallChatDatabase(ChatDatabase):
+    """Baseline reproducing the original behaviour: a fresh connection and rollback journal per call"""
+
+    def _open(self):
+        # Used for the schema setup; the journal mode persists in the file, so this keeps
+        # the baseline on the rollback journal instead of inheriting ChatDatabase's WAL
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=DELETE")
+        return conn
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def create_session(self, session_id):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("INSERT INTO sessions (session_id) VALUES (?)", (session_id,))
+            return True
+        except sqlite3.IntegrityError:
+            return False
+        finally:
+            conn.close()
+
+    def add_message(self, session_id, role, content):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "UPDATE sessions SET last_activity = CURRENT_TIMESTAMP WHERE session_id = ?",
+                    (session_id,)
+                )
+                conn.execute(
+                    "INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)",
+                    (session_id, role, content)
+                )
+        finally:
+            conn.close()
+        return True
+
+
+class ThreadLocalChatDatabase(ChatDatabase):
+    """Baseline reproducing one tuned WAL connection per thread, opened on the thread's first call"""
+
+    def __init__(self, *args, **kwargs):
+        self._local = threading.local()
+        super().__init__(*args, **kwargs)
+
+    @contextmanager
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._open()
+        yield conn
+
+
+def run(db_class, db_path, writers, messages, thread_per_request=False):
+    db = db_class(db_path)
+    with db._connection() as conn:
+        journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    sessions = [str(uuid.uuid4()) for _ in range(writers)]
+    for session_id in sessions:
+        db.create_session(session_id)
+
+    start_barrier = threading.Barrier(writers + 1)
+
+    def writer(session_id):
+        start_barrier.wait()
+        for i in range(messages):
+            args = (session_id, "user" if i % 2 == 0 else "assistant", f"message {i} " + "x" * 200)
+            if thread_per_request:
+                request = threading.Thread(target=db.add_message, args=args)
+                request.start()
+                request.join()
+            else:
+                db.add_message(*args)
+
+    threads = [threading.Thread(target=writer, args=(session_id,)) for session_id in sessions]
+    for thread in threads:
+        thread.start()
+    start_barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    total = writers * messages
+    return {"journal_mode": journal_mode, "messages": total, "seconds": round(elapsed, 4), "messages_per_sec": round(total / elapsed, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", type=int, default=8, help="concurrent writer threads")
+    parser.add_argument("--messages", type=int, default=500, help="messages written per thread")
+    parser.add_argument("--thread-per-request", action="store_true",
+                        help="write every message from a new thread, like a threaded WSGI server")
+    args = parser.parse_args()
+
+    results = {"writers": args.writers, "messages_per_writer": args.messages,
+               "thread_per_request": args.thread_per_request}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, db_class in (("before", ConnectPerCallChatDatabase), ("thread_local", ThreadLocalChatDatabase),
+                               ("after", ChatDatabase)):
+            results[name] = run(db_class, os.path.join(tmp, f"{name}.db"), args.writers, args.messages,
+                                args.thread_per_request)
+    results["speedup"] = round(results["after"]["messages_per_sec"] / results["before"]["messages_per_sec"], 2)
+    results["speedup_vs_thread_local"] = round(
+        results["after"]["messages_per_sec"] / results["thread_local"]["messages_per_sec"], 2
+    )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
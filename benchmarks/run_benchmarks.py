@@ -0,0 +1,324 @@
+"""Latency, throughput and memory of the inference, database and HTTP paths, as JSON.
+
+Uses the bundled sample.jpg, the "Soil types/" images, seeded random nutrient
+records and FakeGeminiClient, so runs are repeatable offline and can be compared
+across commits. Paths whose model is not available (e.g. no my_model.h5) are
+reported as skipped.
+
+Usage:
+    python benchmarks/run_benchmarks.py --output before.json
+    python benchmarks/run_benchmarks.py --output after.json --compare before.json
+    python benchmarks/run_benchmarks.py --only fertility --iterations 500
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from app import NUTRIENT_FIELDS, SoilQualityClassifier, create_app, load_model, preprocess_image  # noqa: E402
+from chat_context import ChatContextBuilder  # noqa: E402
+from chat_database import ChatDatabase  # noqa: E402
+from gemini_cache import FakeGeminiClient  # noqa: E402
+
+FERTILITY_REPLY = '```json\n{"ai_prediction": "Fertile", "confidence": "High", "agreement_with_ml": "Agree"}\n```'
+NUTRIENT_REPLY = ('```json\n{"N": 245, "P": 8.1, "K": 560, "ph": 7.31, "ec": 0.63, "oc": 0.78, "S": 11.6, '
+                  '"zn": 0.29, "fe": 0.43, "cu": 0.57, "Mn": 7.73, "B": 0.74}\n```')
+CHAT_REPLY = "Black soil holds moisture well and suits cotton, soybean and sorghum. " * 4
+
+
+def fake_gemini_reply(model, contents):
+    prompt = contents[0] if isinstance(contents, list) else contents
+    if "verify the machine learning model's fertility prediction" in prompt:
+        return FERTILITY_REPLY
+    if "lab report" in prompt:
+        return NUTRIENT_REPLY
+    return CHAT_REPLY
+
+
+def percentile(samples, q):
+    return round(float(np.percentile(samples, q)) * 1000, 3)
+
+
+def measure(fn, iterations, warmup, items_per_call=1, traced_calls=20):
+    """Call ``fn(i)`` ``iterations`` times after ``warmup`` untimed calls and summarise the timings.
+
+    Peak memory comes from a separate pass of ``traced_calls`` calls, since
+    tracemalloc slows allocation-heavy code down several times over.
+    """
+    for i in range(warmup):
+        fn(i)
+
+    samples = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        call_started = time.perf_counter()
+        fn(warmup + i)
+        samples.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    for i in range(min(iterations, traced_calls)):
+        fn(warmup + iterations + i)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "iterations": iterations,
+        "items_per_call": items_per_call,
+        "throughput_per_s": round(iterations * items_per_call / elapsed, 1),
+        "mean_ms": round(float(np.mean(samples)) * 1000, 3),
+        "p50_ms": percentile(samples, 50),
+        "p95_ms": percentile(samples, 95),
+        "p99_ms": percentile(samples, 99),
+        "peak_traced_mb": round(peak / (1024 * 1024), 3),
+    }
+
+
+def random_records(count, seed=0):
+    """Seeded nutrient records in the ranges seen in the bundled sample data"""
+    rng = np.random.default_rng(seed)
+    scales = {"N": 400, "P": 40, "K": 900, "ph": 3, "ec": 2, "oc": 2, "S": 40, "zn": 2, "fe": 3, "cu": 2, "Mn": 15, "B": 2}
+    records = []
+    for _ in range(count):
+        record = {field: round(float(rng.uniform(0.01, 1.0) * scales[field]), 3) for field in NUTRIENT_FIELDS}
+        record["ph"] = round(5.5 + record["ph"], 2)
+        records.append(record)
+    return records
+
+
+def load_images(limit):
+    paths = [os.path.join(BASE_DIR, "sample.jpg")]
+    soil_images = sorted(glob.glob(os.path.join(BASE_DIR, "Soil types", "*", "*.jpg")))
+    # An even spread over every soil class rather than the first few files of one
+    step = max(1, len(soil_images) // max(1, limit - 1))
+    paths += soil_images[::step][:max(0, limit - 1)]
+    images = []
+    for path in paths:
+        with open(path, "rb") as file:
+            images.append((os.path.basename(path), file.read()))
+    return images
+
+
+def bench_preprocess(args, images):
+    return {
+        "preprocess_image": measure(lambda i: preprocess_image(images[i % len(images)][1]),
+                                    args.iterations, args.warmup),
+    }
+
+
+def bench_soil_model(args, images):
+    model_path = os.environ.get("MODEL_PATH", os.path.join(BASE_DIR, "my_model.h5"))
+    try:
+        model = load_model(model_path)
+    except Exception as e:
+        return {"soil_model": {"skipped": f"could not load '{model_path}': {e}"}}
+
+    tensors = [preprocess_image(image) for _, image in images]
+    batch = np.concatenate([tensors[i % len(tensors)] for i in range(32)])
+    return {
+        "soil_model.single": measure(lambda i: model.predict_on_batch(tensors[i % len(tensors)]),
+                                     args.iterations, args.warmup),
+        "soil_model.batch32": measure(lambda i: model.predict_on_batch(batch),
+                                      max(1, args.iterations // 8), args.warmup, items_per_call=32),
+    }
+
+
+def bench_fertility(args, records):
+    results = {}
+    engine_path = os.path.join(BASE_DIR, "random_forest.npz")
+    variants = [("sklearn", None)]
+    if os.path.exists(engine_path):
+        variants.append(("forest_engine", engine_path))
+
+    for label, path in variants:
+        started = time.perf_counter()
+        classifier = SoilQualityClassifier(os.path.join(BASE_DIR, "random_forest_pkl.pkl"), engine_path=path)
+        results[f"fertility.{label}.load"] = {"seconds": round(time.perf_counter() - started, 4)}
+        results[f"fertility.{label}.single"] = measure(
+            lambda i: classifier.compute_prediction(records[i % len(records)]), args.iterations, args.warmup
+        )
+        results[f"fertility.{label}.batch256"] = measure(
+            lambda i: classifier.compute_prediction_batch(records[:256]),
+            max(1, args.iterations // 8), args.warmup, items_per_call=256
+        )
+    return results
+
+
+def bench_chat_db(args, workdir):
+    db = ChatDatabase(os.path.join(workdir, "bench_chat.db"))
+    session_id = str(uuid.uuid4())
+    db.create_session(session_id)
+    context = ChatContextBuilder(db)
+
+    def write(i):
+        db.add_message(session_id, "user" if i % 2 == 0 else "assistant", f"message {i} " + "x" * 200)
+
+    turn = {"session_id": session_id, "user_message": "What should I grow?", "user_language": "en", "image_data": None}
+    return {
+        "chat_db.add_message": measure(write, args.iterations, args.warmup),
+        "chat_db.history_page": measure(lambda i: db.get_session_history_page(session_id, limit=50),
+                                        args.iterations, args.warmup),
+        "chat_context.build": measure(lambda i: context.build(turn), args.iterations, args.warmup),
+    }
+
+
+def bench_endpoints(args, images, records):
+    os.environ.setdefault("MODEL_WARMUP", "eager" if os.path.exists(
+        os.environ.get("MODEL_PATH", os.path.join(BASE_DIR, "my_model.h5"))) else "lazy")
+    gemini = FakeGeminiClient(fake_gemini_reply, latency=args.gemini_latency_ms / 1000.0)
+    try:
+        app = create_app(gemini_client=gemini)
+    except Exception as e:
+        return {"endpoints": {"skipped": f"create_app failed: {e}"}}
+    client = app.test_client()
+    session_id = client.post("/chat/session").get_json()["session_id"]
+    json_images = images[:8]
+
+    def post_image(path, i, field="file"):
+        name, data = json_images[i % len(json_images)]
+        return client.post(path, data={field: (io.BytesIO(data), name)})
+
+    def check(response):
+        if response.status_code >= 500:
+            raise RuntimeError(f"{response.status_code}: {response.get_data(as_text=True)[:200]}")
+
+    results = {
+        "endpoint.health": measure(lambda i: check(client.get("/health")), args.iterations, args.warmup),
+        # Distinct records, so these measure the model and Gemini path rather than the prediction cache
+        "endpoint.predict_fertility": measure(
+            lambda i: check(client.post("/predict-fertility", json=records[i % len(records)])),
+            min(args.iterations, len(records) - args.warmup - 20), args.warmup
+        ),
+        "endpoint.predict_fertility.cached": measure(
+            lambda i: check(client.post("/predict-fertility", json=records[0])), args.iterations, args.warmup
+        ),
+        "endpoint.extract_nutrients": measure(lambda i: check(post_image("/extract-nutrients", i)),
+                                              args.iterations, args.warmup),
+        "endpoint.chat_message": measure(
+            lambda i: check(client.post("/chat/message", json={"session_id": session_id, "message": f"question {i}"})),
+            args.iterations, args.warmup
+        ),
+    }
+
+    if client.get("/ready").status_code == 200:
+        probe = post_image("/predict-type", 0)
+        if probe.status_code == 200:
+            results["endpoint.predict_type"] = measure(lambda i: check(post_image("/predict-type", i)),
+                                                       args.iterations, args.warmup)
+            batch_files = [(io.BytesIO(data), name) for name, data in images[:16]]
+
+            def post_batch(i):
+                for file, _ in batch_files:
+                    file.seek(0)
+                check(client.post("/predict-type/batch", data={"files": batch_files}))
+
+            results["endpoint.predict_type_batch16"] = measure(post_batch, max(1, args.iterations // 8),
+                                                               args.warmup, items_per_call=16)
+        else:
+            results["endpoint.predict_type"] = {"skipped": f"/predict-type returned {probe.status_code}"}
+    return results
+
+
+BENCHMARKS = {
+    "preprocess": lambda args, ctx: bench_preprocess(args, ctx["images"]),
+    "soil_model": lambda args, ctx: bench_soil_model(args, ctx["images"]),
+    "fertility": lambda args, ctx: bench_fertility(args, ctx["records"]),
+    "chat_db": lambda args, ctx: bench_chat_db(args, ctx["workdir"]),
+    "endpoints": lambda args, ctx: bench_endpoints(args, ctx["images"], ctx["records"]),
+}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline_path):
+    """Per-benchmark p50 and throughput ratios against an earlier run (>1 means faster now)"""
+    with open(baseline_path) as file:
+        baseline = json.load(file)["results"]
+    changes = {}
+    for name, current in results.items():
+        before = baseline.get(name)
+        if not before or "p50_ms" not in current or "p50_ms" not in before:
+            continue
+        changes[name] = {
+            "p50_speedup": round(before["p50_ms"] / current["p50_ms"], 3) if current["p50_ms"] else None,
+            "throughput_ratio": round(current["throughput_per_s"] / before["throughput_per_s"], 3)
+            if before["throughput_per_s"] else None,
+        }
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200, help="timed calls per benchmark")
+    parser.add_argument("--warmup", type=int, default=10, help="untimed calls before each benchmark")
+    parser.add_argument("--images", type=int, default=64, help="images from 'Soil types/' to cycle through")
+    parser.add_argument("--gemini-latency-ms", type=float, default=0.0, help="simulated Gemini latency")
+    parser.add_argument("--only", nargs="*", choices=sorted(BENCHMARKS), help="run only these groups")
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    parser.add_argument("--compare", help="earlier JSON report to compute speedups against")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # create_app writes chat_history.db and gemini_cache.db to the working directory
+        os.chdir(workdir)
+        os.environ["GEMINI_CACHE_PATH"] = os.path.join(workdir, "gemini_cache.db")
+        os.environ.pop("PREDICTION_CACHE_PATH", None)
+
+        context = {
+            "images": load_images(args.images),
+            "records": random_records(max(args.iterations + args.warmup + 20, 256)),
+            "workdir": workdir,
+        }
+        results = {}
+        for name in args.only or BENCHMARKS:
+            started = time.perf_counter()
+            results.update(BENCHMARKS[name](args, context))
+            print(f"{name}: {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+            # ru_maxrss is KiB on Linux and bytes on macOS
+            "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                                / (1024 * 1024 if sys.platform == "darwin" else 1024), 1),
+        },
+        "results": results,
+    }
+    if args.compare:
+        report["comparison"] = compare(results, args.compare)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
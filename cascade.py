@@ -0,0 +1,255 @@
+"""Confidence-gated cascade for soil type classification.
+
+Most soil classes differ clearly in colour, so a logistic regression over colour
+histograms of the preprocessed 224x224 image can name them in well under a
+millisecond. With CASCADE=on, /predict-type and /predict-type/batch send an image
+to the full model only when this first stage is not confident enough. The
+thresholds are per class. ``train`` calibrates them on a held-out split so that
+first-stage answers reach ``--target-precision``. CASCADE_THRESHOLD overrides them
+at serving time.
+
+Usage:
+    python cascade.py train --images "Soil types" --output soil_cascade.npz
+    python cascade.py evaluate --images "Soil types" --model soil_cascade.npz [--threshold 0.9]
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from metrics import REGISTRY, Counter
+
+CASCADE_PREDICTIONS = REGISTRY.register(Counter(
+    "soil_cascade_predictions_total", "Soil images answered by the cascade's first stage or escalated",
+    ("stage",)
+))
+
+
+def color_histograms(batch: np.ndarray, bins: int) -> np.ndarray:
+    """Square-rooted joint RGB histograms of a (n, h, w, 3) batch scaled to [0, 1], one row per image"""
+    n = len(batch)
+    levels = np.minimum((batch * bins).astype(np.int32), bins - 1)
+    cells = (levels[..., 0] * bins + levels[..., 1]) * bins + levels[..., 2]
+    # One bincount for the whole batch: image i counts into bins [i * bins^3, (i + 1) * bins^3)
+    cells = cells.reshape(n, -1) + (np.arange(n, dtype=np.int32) * bins ** 3)[:, None]
+    counts = np.bincount(cells.ravel(), minlength=n * bins ** 3).reshape(n, bins ** 3)
+    return np.sqrt(counts / np.float32(cells.shape[1])).astype(np.float32)
+
+
+class SoilCascade:
+    """First stage of the cascade: colour-histogram logistic regression with per-class confidence thresholds"""
+
+    def __init__(self, arrays: dict, threshold: Optional[float] = None):
+        self.bins = int(arrays["bins"])
+        self.mean = arrays["mean"]
+        self.scale = arrays["scale"]
+        self.coef = arrays["coef"]
+        self.intercept = arrays["intercept"]
+        self.thresholds = np.array(arrays["thresholds"], dtype=np.float64)
+        if threshold is not None:
+            self.thresholds[:] = threshold
+        self.report = json.loads(str(arrays["report"])) if "report" in arrays else {}
+        self._lock = threading.Lock()
+        self._answered = np.zeros(len(self.thresholds), dtype=np.int64)
+        self._escalated = 0
+
+    @classmethod
+    def load(cls, path: str, threshold: Optional[float] = None) -> "SoilCascade":
+        with np.load(path) as arrays:
+            return cls({name: arrays[name] for name in arrays.files}, threshold=threshold)
+
+    def save(self, path: str):
+        np.savez(
+            path,
+            bins=np.array(self.bins, dtype=np.int32),
+            mean=self.mean,
+            scale=self.scale,
+            coef=self.coef,
+            intercept=self.intercept,
+            thresholds=self.thresholds,
+            report=np.array(json.dumps(self.report)),
+        )
+
+    def predict_proba(self, batch: np.ndarray) -> np.ndarray:
+        logits = ((color_histograms(batch, self.bins) - self.mean) / self.scale) @ self.coef.T + self.intercept
+        logits -= logits.max(axis=1, keepdims=True)
+        probs = np.exp(logits)
+        return probs / probs.sum(axis=1, keepdims=True)
+
+    def classify(self, batch: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Return (predicted index, confidence, confident) per image and count them in the stats"""
+        probs = self.predict_proba(batch)
+        indices = np.argmax(probs, axis=1)
+        confidences = probs[np.arange(len(probs)), indices]
+        confident = confidences >= self.thresholds[indices]
+
+        with self._lock:
+            np.add.at(self._answered, indices[confident], 1)
+            self._escalated += int(len(confident) - confident.sum())
+        CASCADE_PREDICTIONS.inc(float(confident.sum()), stage="first")
+        CASCADE_PREDICTIONS.inc(float(len(confident) - confident.sum()), stage="escalated")
+        return indices, confidences, confident
+
+    def stats(self, class_names) -> Dict:
+        with self._lock:
+            answered = self._answered.copy()
+            escalated = self._escalated
+        total = int(answered.sum()) + escalated
+        return {
+            "images": total,
+            "answered_by_first_stage": int(answered.sum()),
+            "escalated": escalated,
+            "escalation_rate": round(escalated / total, 4) if total else None,
+            "answered_per_class": {name: int(count) for name, count in zip(class_names, answered)},
+            # None: the class always escalates
+            "thresholds": {name: None if np.isinf(threshold) else round(float(threshold), 4)
+                           for name, threshold in zip(class_names, self.thresholds)},
+        }
+
+
+def calibrate_thresholds(probs: np.ndarray, labels: np.ndarray, target_precision: float,
+                         min_threshold: float) -> np.ndarray:
+    """Per class, the lowest confidence at which first-stage answers still reach ``target_precision``.
+
+    A class whose most confident prediction is already wrong gets an infinite
+    threshold and always escalates.
+    """
+    indices = np.argmax(probs, axis=1)
+    confidences = probs[np.arange(len(probs)), indices]
+    thresholds = np.full(probs.shape[1], np.inf)
+    for index in range(probs.shape[1]):
+        members = np.flatnonzero(indices == index)
+        order = members[np.argsort(-confidences[members])]
+        precision = np.cumsum(labels[order] == index) / np.arange(1, len(order) + 1)
+        passing = np.flatnonzero(precision >= target_precision)
+        if len(passing):
+            thresholds[index] = max(confidences[order[passing[-1]]], min_threshold)
+    return thresholds
+
+
+def evaluation_report(cascade: SoilCascade, probs: np.ndarray, labels: np.ndarray, class_names) -> Dict:
+    indices = np.argmax(probs, axis=1)
+    confidences = probs[np.arange(len(probs)), indices]
+    confident = confidences >= cascade.thresholds[indices]
+    return {
+        "images": int(len(labels)),
+        "first_stage_accuracy": round(float(np.mean(indices == labels)), 4),
+        "escalation_rate": round(float(1.0 - confident.mean()), 4),
+        "answered_accuracy": round(float(np.mean(indices[confident] == labels[confident])), 4)
+        if confident.any() else None,
+        "thresholds": {name: None if np.isinf(threshold) else round(float(threshold), 4)
+                       for name, threshold in zip(class_names, cascade.thresholds)},
+    }
+
+
+def load_images(images, workers: int) -> np.ndarray:
+    """Preprocess (path, label) pairs exactly as the server does, into one (n, 224, 224, 3) batch"""
+    from app import IMAGE_SIZE, preprocess_image
+
+    batch = np.empty((len(images), IMAGE_SIZE[1], IMAGE_SIZE[0], 3), dtype=np.float32)
+
+    def load(indexed):
+        index, (path, _) = indexed
+        with open(path, "rb") as file:
+            preprocess_image(file.read(), out=batch[index])
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(load, enumerate(images)))
+    return batch
+
+
+def train(args):
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.preprocessing import StandardScaler
+
+    from app import CLASS_NAMES
+    from training import list_labelled_images, split_images
+
+    splits = split_images(list_labelled_images(args.images), val_fraction=args.val_fraction, seed=args.seed)
+    started = time.perf_counter()
+    features, labels = {}, {}
+    for split, images in splits.items():
+        features[split] = color_histograms(load_images(images, args.workers), args.bins)
+        labels[split] = np.array([label for _, label in images])
+    load_seconds = time.perf_counter() - started
+
+    scaler = StandardScaler().fit(features["train"])
+    regression = LogisticRegression(C=args.C, max_iter=5000)
+    regression.fit(scaler.transform(features["train"]), labels["train"])
+    val_probs = regression.predict_proba(scaler.transform(features["val"]))
+
+    cascade = SoilCascade({
+        "bins": args.bins,
+        # Constant histogram cells have a zero scale; StandardScaler leaves those unscaled too
+        "mean": scaler.mean_.astype(np.float32),
+        "scale": scaler.scale_.astype(np.float32),
+        "coef": regression.coef_.astype(np.float32),
+        "intercept": regression.intercept_.astype(np.float32),
+        "thresholds": calibrate_thresholds(val_probs, labels["val"], args.target_precision, args.min_threshold),
+    })
+    cascade.report = {
+        # Relative to the saved model, so the file does not record this machine's layout
+        "images": os.path.relpath(args.images, os.path.dirname(os.path.abspath(args.output))),
+        "train_images": int(len(labels["train"])),
+        "target_precision": args.target_precision,
+        "bins": args.bins,
+        "C": args.C,
+        "validation": evaluation_report(cascade, val_probs, labels["val"], CLASS_NAMES),
+    }
+    cascade.save(args.output)
+    print(json.dumps({**cascade.report, "output": args.output, "load_seconds": round(load_seconds, 3)}, indent=2))
+
+
+def evaluate(args):
+    from app import CLASS_NAMES
+    from training import list_labelled_images
+
+    cascade = SoilCascade.load(args.model, threshold=args.threshold)
+    images = list_labelled_images(args.images)
+    batch = load_images(images, args.workers)
+    started = time.perf_counter()
+    probs = cascade.predict_proba(batch)
+    seconds = time.perf_counter() - started
+    report = evaluation_report(cascade, probs, np.array([label for _, label in images]), CLASS_NAMES)
+    report["first_stage_ms_per_image"] = round(seconds * 1000 / len(images), 4)
+    print(json.dumps(report, indent=2))
+
+
+def main():
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Train or evaluate the first stage of the soil type cascade")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    train_parser = subparsers.add_parser("train", help="fit the colour-histogram classifier and calibrate thresholds")
+    train_parser.add_argument("--images", default=os.path.join(base_dir, "Soil types"))
+    train_parser.add_argument("--output", default=os.environ.get("CASCADE_MODEL_PATH", os.path.join(base_dir, "soil_cascade.npz")))
+    train_parser.add_argument("--bins", type=int, default=8, help="histogram bins per RGB channel")
+    train_parser.add_argument("--C", type=float, default=1.0, help="inverse regularisation strength")
+    train_parser.add_argument("--target-precision", type=float, default=0.98,
+                              help="accuracy the first stage must reach on the images it answers")
+    train_parser.add_argument("--min-threshold", type=float, default=0.8,
+                              help="lowest confidence threshold calibration may choose")
+    train_parser.add_argument("--val-fraction", type=float, default=0.25)
+    train_parser.add_argument("--seed", type=int, default=35)
+    train_parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+
+    evaluate_parser = subparsers.add_parser("evaluate", help="report escalation rate and accuracy on an image tree")
+    evaluate_parser.add_argument("--images", default=os.path.join(base_dir, "Soil types"))
+    evaluate_parser.add_argument("--model", default=os.environ.get("CASCADE_MODEL_PATH", os.path.join(base_dir, "soil_cascade.npz")))
+    evaluate_parser.add_argument("--threshold", type=float, default=None, help="one threshold for every class")
+    evaluate_parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    args = parser.parse_args()
+
+    if args.command == "train":
+        train(args)
+    else:
+        evaluate(args)
+
+
+if __name__ == "__main__":
+    main()
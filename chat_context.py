@@ -0,0 +1,208 @@
+"""Bounded chat prompts: a fixed system prompt, a rolling summary of older turns and the newest turns.
+
+Every turn reads only the messages newer than the stored summary. Once those no
+longer fit the token budget, the oldest of them are folded into the summary (one
+extra Gemini call), so the prompt size stays bounded however long the session gets.
+That call runs on a background thread, off the request path; turns keep using the
+stored summary until the new one is saved.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+# One system prompt per language, shared by text and image turns
+SYSTEM_PROMPTS = {
+    "en": """You are an expert agricultural AI assistant specializing in soil analysis and farming. 
+
+🎯 CRITICAL INSTRUCTIONS - READ CAREFULLY:
+
+When the user provides ANY of these nutrient values: N, P, K, pH, EC, OC, S, Zn, Fe, Cu, Mn, B
+You MUST respond with THIS EXACT JSON format (no extra text, just the JSON):
+
+```json
+{
+  "action": "analyze_fertility",
+  "nutrients": {
+    "N": <value>, "P": <value>, "K": <value>, "ph": <value>,
+    "ec": <value>, "oc": <value>, "S": <value>, "zn": <value>,
+    "fe": <value>, "cu": <value>, "Mn": <value>, "B": <value>
+  },
+  "message": "I'll analyze your soil fertility now!"
+}
+```
+
+EXAMPLES:
+User: "N=245, P=8.1, K=560" → Return JSON with these values (fill missing with 0)
+User: "analyze my soil with nitrogen 200" → Return JSON with N=200, rest 0
+User: "Can you check N=245 P=8.1 K=560 pH=7.3" → Return JSON
+
+For OTHER questions (crops, advice, general farming), respond normally with helpful text.
+
+When analyzing images, provide detailed observations about soil type, color, and crops.
+
+Be friendly, helpful, and practical. Respond in English.""",
+    "hi": """आप एक विशेषज्ञ कृषि AI सहायक हैं जो मिट्टी विश्लेषण और खेती में विशेषज्ञता रखते हैं।
+
+🎯 महत्वपूर्ण निर्देश - ध्यान से पढ़ें:
+
+जब उपयोगकर्ता इन पोषक तत्व मानों में से कोई भी प्रदान करता है: N, P, K, pH, EC, OC, S, Zn, Fe, Cu, Mn, B
+आपको इस सटीक JSON प्रारूप में उत्तर देना चाहिए (कोई अतिरिक्त पाठ नहीं, केवल JSON):
+
+```json
+{
+  "action": "analyze_fertility",
+  "nutrients": {
+    "N": <value>, "P": <value>, "K": <value>, "ph": <value>,
+    "ec": <value>, "oc": <value>, "S": <value>, "zn": <value>,
+    "fe": <value>, "cu": <value>, "Mn": <value>, "B": <value>
+  },
+  "message": "मैं अब आपकी मिट्टी की उर्वरता का विश्लेषण करूंगा!"
+}
+```
+
+उदाहरण:
+उपयोगकर्ता: "N=245, P=8.1, K=560" → इन मानों के साथ JSON लौटाएं (गायब को 0 से भरें)
+उपयोगकर्ता: "नाइट्रोजन 200 के साथ मेरी मिट्टी का विश्लेषण करें" → N=200, बाकी 0 के साथ JSON लौटाएं
+
+अन्य प्रश्नों (फसलें, सलाह, सामान्य खेती) के लिए, सहायक पाठ के साथ सामान्य रूप से उत्तर दें।
+
+छवियों का विश्लेषण करते समय, मिट्टी के प्रकार, रंग और फसलों के बारे में विस्तृत अवलोकन प्रदान करें।
+
+मैत्रीपूर्ण, सहायक और व्यावहारिक रहें। सभी उत्तर हिंदी में दें।""",
+}
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a farmer and an agricultural AI assistant.
+Update the summary with the new messages below. Keep every fact that may matter later: soil type, nutrient
+values, crops, location, problems and advice already given. Write at most {max_words} words of plain text.
+
+Current summary:
+{summary}
+
+New messages:
+{messages}
+
+Updated summary:"""
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 UTF-8 bytes per token), no tokenizer needed"""
+    return len(text.encode("utf-8")) // 4 + 1
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut ``text`` so its estimate fits in ``max_tokens``"""
+    data = text.encode("utf-8")
+    limit = max(0, max_tokens - 1) * 4
+    if len(data) <= limit:
+        return text
+    return data[:limit].decode("utf-8", errors="ignore").rstrip() + "..."
+
+
+def format_message(message: Dict) -> str:
+    return f"{message['role'].capitalize()}: {message['content']}\n"
+
+
+class ChatContextBuilder:
+    """Builds the Gemini contents for a chat turn within a fixed token budget.
+
+    ``history_tokens`` caps the verbatim recent turns, ``summary_tokens`` the rolling
+    summary. ``summarize`` takes (previous summary, messages to fold in) and returns
+    the new summary; without it, turns that fall out of the budget are just dropped.
+    It runs on ``summary_workers`` background threads, at most once per session at a time.
+    """
+
+    def __init__(self, chat_db, summarize: Optional[Callable[[str, List[Dict]], str]] = None,
+                 history_tokens: int = 2000, summary_tokens: int = 400, max_unsummarized: int = 200,
+                 summary_workers: int = 2):
+        self.chat_db = chat_db
+        self.summarize = summarize
+        self.history_tokens = history_tokens
+        self.summary_tokens = summary_tokens
+        self.max_unsummarized = max_unsummarized
+        self._executor = ThreadPoolExecutor(max_workers=summary_workers, thread_name_prefix="chat-summary")
+        self._folding = set()
+        self._lock = threading.Lock()
+
+    def build(self, turn: Dict):
+        """Return the contents for ``turn``, whose user message must already be stored"""
+        session_id = turn["session_id"]
+        stored = self.chat_db.get_summary(session_id)
+        summary = stored["summary"] if stored else ""
+        summarized_through_id = stored["summarized_through_id"] if stored else 0
+
+        # The newest message is the user turn being answered, which goes in separately
+        messages = self.chat_db.get_messages_after(session_id, summarized_through_id, limit=self.max_unsummarized + 1)
+        messages = messages[:-1]
+
+        recent, older = self._split_recent(messages, self.history_tokens)
+        if older and self.summarize is not None:
+            # Fold down to half the budget, so the next summary update is several turns away.
+            # This turn goes ahead with the stored summary and the turns that fit
+            _, older = self._split_recent(messages, self.history_tokens // 2)
+            self._schedule_fold(session_id, summary, older)
+
+        context = SYSTEM_PROMPTS.get(turn["user_language"], SYSTEM_PROMPTS["en"])
+        if summary:
+            context += "\n\nSummary of the earlier conversation:\n" + summary
+        if recent:
+            context += "\n\nRecent conversation:\n" + "".join(format_message(message) for message in recent)
+
+        user_message = turn["user_message"]
+        if turn["image_data"] is not None:
+            prompt = f"{context}\n\nUser sent an image and says: {user_message}\n\nPlease analyze the image and respond to the user.\nAssistant:"
+            return [prompt, turn["image_data"]]
+        return f"{context}\n\nUser: {user_message}\nAssistant:"
+
+    def _split_recent(self, messages: List[Dict], budget: int):
+        """Split messages into (recent, older), keeping as many of the newest as fit in ``budget`` tokens"""
+        used = 0
+        start = len(messages)
+        while start > 0:
+            cost = estimate_tokens(format_message(messages[start - 1]))
+            if used + cost > budget:
+                break
+            used += cost
+            start -= 1
+        return messages[start:], messages[:start]
+
+    def _schedule_fold(self, session_id: str, summary: str, older: List[Dict]):
+        """Fold ``older`` into the summary on the background executor unless the session already has a fold running"""
+        with self._lock:
+            if session_id in self._folding:
+                return
+            self._folding.add(session_id)
+
+        def run():
+            try:
+                self._fold(session_id, summary, older)
+            finally:
+                with self._lock:
+                    self._folding.discard(session_id)
+
+        self._executor.submit(run)
+
+    def _fold(self, session_id: str, summary: str, older: List[Dict]) -> str:
+        """Fold ``older`` into the rolling summary and persist it; on failure keep the old summary"""
+        try:
+            new_summary = truncate_to_tokens(self.summarize(summary, older).strip(), self.summary_tokens)
+        except Exception as e:
+            print(f"Warning: chat summary update failed for session {session_id}: {e}")
+            return summary
+        self.chat_db.save_summary(session_id, new_summary, older[-1]["id"])
+        return new_summary
+
+
+def gemini_summarizer(gemini_client, model: str = "gemini-2.5-flash", max_words: int = 250):
+    """Return a ``summarize`` function for ChatContextBuilder backed by Gemini"""
+    def summarize(summary: str, messages: List[Dict]) -> str:
+        response = gemini_client.models.generate_content(
+            model=model,
+            contents=SUMMARY_PROMPT.format(
+                max_words=max_words,
+                summary=summary or "(none yet)",
+                messages="".join(format_message(message) for message in messages),
+            )
+        )
+        return response.text
+
+    return summarize
@@ -1,139 +1,401 @@
 import sqlite3
 import json
+import asyncio
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 from typing import List, Dict, Optional
 
+from metrics import timed
+
+# Ordered schema migrations; PRAGMA user_version records how many have been applied
+MIGRATIONS = [
+    # 1: history reads filter by session and page newest-first by id, and session
+    # listings sort by last activity, so both need covering indexes to avoid full scans
+    [
+        "CREATE INDEX IF NOT EXISTS idx_messages_session_id ON messages (session_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_sessions_last_activity ON sessions (last_activity, session_id)",
+    ],
+    # 2: rolling per-session summaries used by chat_context.ChatContextBuilder; messages
+    # with id <= summarized_through_id are represented by the summary text
+    [
+        """
+        CREATE TABLE IF NOT EXISTS session_summaries (
+            session_id TEXT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            summarized_through_id INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (session_id) REFERENCES sessions(session_id)
+        )
+        """,
+    ],
+]
+
+
 class ChatDatabase:
-    def __init__(self, db_path="chat_history.db"):
+    def __init__(self, db_path="chat_history.db", cache_size_kb: int = 8192, cached_statements: int = 256,
+                 pool_size: int = 8):
         self.db_path = db_path
+        self.cache_size_kb = cache_size_kb
+        self.cached_statements = cached_statements
+        # A small pool of long-lived connections shared by all threads. Threaded servers
+        # start a new thread per request, so per-thread connections would be opened (and
+        # tuned) on every request; reconnecting costs more than the query itself
+        self.pool_size = pool_size
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._pool_lock = threading.Lock()
         self.init_database()
-    
+
+    def _open(self) -> sqlite3.Connection:
+        """Open and tune a new connection"""
+        # cached_statements keeps compiled statements around, so the fixed SQL
+        # strings below are prepared once per connection and then reused.
+        # check_same_thread=False: the pool hands a connection to one thread at a time
+        conn = sqlite3.connect(self.db_path, timeout=30, cached_statements=self.cached_statements,
+                               check_same_thread=False)
+        # WAL lets readers proceed during writes and makes commits append-only
+        conn.execute("PRAGMA journal_mode=WAL")
+        # NORMAL is durable across application crashes in WAL mode, only an OS
+        # crash can lose the last transactions
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kb)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        """Borrow a pooled connection for the duration of the block.
+
+        At most ``pool_size`` connections are open; when all are in use the caller
+        waits for one to be returned.
+        """
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._pool_lock:
+                open_new = self._opened < self.pool_size
+                if open_new:
+                    self._opened += 1
+            if open_new:
+                try:
+                    conn = self._open()
+                except BaseException:
+                    with self._pool_lock:
+                        self._opened -= 1
+                    raise
+            else:
+                try:
+                    conn = self._idle.get(timeout=30)
+                except queue.Empty:
+                    raise TimeoutError(f"All {self.pool_size} chat database connections stayed busy for 30s") from None
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+    def _query(self, sql: str, params=()) -> list:
+        """Run a read on a pooled connection and return all its rows"""
+        with self._connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def close(self):
+        """Close the idle pooled connections"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            conn.close()
+            with self._pool_lock:
+                self._opened -= 1
+
     def init_database(self):
         """Initialize the database with required tables"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Create sessions table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS sessions (
-                session_id TEXT PRIMARY KEY,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Create messages table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id TEXT NOT NULL,
-                role TEXT NOT NULL,
-                content TEXT NOT NULL,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (session_id) REFERENCES sessions(session_id)
-            )
-        """)
-        
-        conn.commit()
-        conn.close()
-    
+        with self._connection() as conn, conn:
+            # Create sessions table
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            # Create messages table
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (session_id) REFERENCES sessions(session_id)
+                )
+            """)
+
+        self.migrate()
+
+    def migrate(self):
+        """Apply any schema migrations newer than the database's user_version"""
+        with self._connection() as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+                with conn:
+                    for statement in statements:
+                        conn.execute(statement)
+                    conn.execute(f"PRAGMA user_version = {number}")
+
+    @timed("chat_db.create_session")
     def create_session(self, session_id: str) -> bool:
         """Create a new chat session"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO sessions (session_id) VALUES (?)",
-                (session_id,)
-            )
-            conn.commit()
-            conn.close()
+            with self._connection() as conn, conn:
+                conn.execute(
+                    "INSERT INTO sessions (session_id) VALUES (?)",
+                    (session_id,)
+                )
             return True
         except sqlite3.IntegrityError:
             return False
-    
+
+    @timed("chat_db.add_message")
     def add_message(self, session_id: str, role: str, content: str) -> bool:
         """Add a message to the session"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Update session last activity
-        cursor.execute(
-            "UPDATE sessions SET last_activity = CURRENT_TIMESTAMP WHERE session_id = ?",
-            (session_id,)
-        )
-        
-        # Insert message
-        cursor.execute(
-            "INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)",
-            (session_id, role, content)
-        )
-        
-        conn.commit()
-        conn.close()
+        with self._connection() as conn, conn:
+            # Update session last activity
+            conn.execute(
+                "UPDATE sessions SET last_activity = CURRENT_TIMESTAMP WHERE session_id = ?",
+                (session_id,)
+            )
+
+            # Insert message
+            conn.execute(
+                "INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)",
+                (session_id, role, content)
+            )
         return True
-    
+
     def get_session_history(self, session_id: str, limit: int = 50) -> List[Dict]:
         """Get chat history for a session"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            """
-            SELECT role, content, timestamp 
-            FROM messages 
-            WHERE session_id = ? 
-            ORDER BY timestamp DESC 
-            LIMIT ?
-            """,
-            (session_id, limit)
-        )
-        
+        return self.get_session_history_page(session_id, limit=limit)["messages"]
+
+    @timed("chat_db.get_session_history_page")
+    def get_session_history_page(self, session_id: str, limit: int = 50,
+                                 before_id: Optional[int] = None) -> Dict:
+        """Get one page of a session's history using keyset pagination.
+
+        Returns up to ``limit`` messages older than ``before_id`` (the newest page when
+        omitted) in chronological order, plus ``next_cursor`` to pass as ``before_id``
+        for the previous page, or None when there are no older messages. Each read is
+        an index range scan, so its cost depends on the page size, not the table size.
+        """
+        if before_id is None:
+            rows = self._query(
+                """
+                SELECT id, role, content, timestamp
+                FROM messages
+                WHERE session_id = ?
+                ORDER BY id DESC
+                LIMIT ?
+                """,
+                (session_id, limit + 1)
+            )
+        else:
+            rows = self._query(
+                """
+                SELECT id, role, content, timestamp
+                FROM messages
+                WHERE session_id = ? AND id < ?
+                ORDER BY id DESC
+                LIMIT ?
+                """,
+                (session_id, before_id, limit + 1)
+            )
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
         messages = []
-        for row in cursor.fetchall():
+        for row in rows:
             messages.append({
-                "role": row[0],
-                "content": row[1],
-                "timestamp": row[2]
+                "id": row[0],
+                "role": row[1],
+                "content": row[2],
+                "timestamp": row[3]
             })
-        
-        conn.close()
+
         # Reverse to get chronological order
-        return list(reversed(messages))
-    
+        return {
+            "messages": list(reversed(messages)),
+            "next_cursor": rows[-1][0] if has_more else None
+        }
+
+    @timed("chat_db.get_messages_after")
+    def get_messages_after(self, session_id: str, after_id: int = 0, limit: int = 50) -> List[Dict]:
+        """Get the newest ``limit`` messages with an id above ``after_id``, in chronological order"""
+        rows = self._query(
+            """
+            SELECT id, role, content, timestamp
+            FROM messages
+            WHERE session_id = ? AND id > ?
+            ORDER BY id DESC
+            LIMIT ?
+            """,
+            (session_id, after_id, limit)
+        )
+
+        return [
+            {"id": row[0], "role": row[1], "content": row[2], "timestamp": row[3]}
+            for row in reversed(rows)
+        ]
+
+    @timed("chat_db.get_summary")
+    def get_summary(self, session_id: str) -> Optional[Dict]:
+        """Get a session's rolling summary, or None if nothing has been summarized yet"""
+        rows = self._query(
+            "SELECT summary, summarized_through_id FROM session_summaries WHERE session_id = ?",
+            (session_id,)
+        )
+        if not rows:
+            return None
+        return {"summary": rows[0][0], "summarized_through_id": rows[0][1]}
+
+    @timed("chat_db.save_summary")
+    def save_summary(self, session_id: str, summary: str, summarized_through_id: int) -> bool:
+        """Replace a session's rolling summary"""
+        with self._connection() as conn, conn:
+            conn.execute(
+                """
+                INSERT INTO session_summaries (session_id, summary, summarized_through_id, updated_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(session_id) DO UPDATE SET
+                    summary = excluded.summary,
+                    summarized_through_id = excluded.summarized_through_id,
+                    updated_at = excluded.updated_at
+                """,
+                (session_id, summary, summarized_through_id)
+            )
+        return True
+
+    @timed("chat_db.clear_session")
     def clear_session(self, session_id: str) -> bool:
         """Clear all messages for a session"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
-        cursor.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
-        
-        conn.commit()
-        conn.close()
+        with self._connection() as conn, conn:
+            conn.execute("DELETE FROM session_summaries WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
         return True
-    
+
+    @timed("chat_db.get_all_sessions")
     def get_all_sessions(self) -> List[Dict]:
-        """Get all active sessions"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute(
+        """Get all active sessions (prefer get_sessions_page for large databases)"""
+        rows = self._query(
             """
-            SELECT session_id, created_at, last_activity 
-            FROM sessions 
+            SELECT session_id, created_at, last_activity
+            FROM sessions
             ORDER BY last_activity DESC
             """
         )
-        
+
         sessions = []
-        for row in cursor.fetchall():
+        for row in rows:
             sessions.append({
                 "session_id": row[0],
                 "created_at": row[1],
                 "last_activity": row[2]
             })
-        
-        conn.close()
+
         return sessions
 
+    @timed("chat_db.get_sessions_page")
+    def get_sessions_page(self, limit: int = 50, cursor: Optional[str] = None) -> Dict:
+        """Get sessions by most recent activity, one keyset page at a time.
+
+        ``cursor`` is the ``next_cursor`` returned by the previous page.
+        """
+        if cursor is None:
+            rows = self._query(
+                """
+                SELECT session_id, created_at, last_activity
+                FROM sessions
+                ORDER BY last_activity DESC, session_id DESC
+                LIMIT ?
+                """,
+                (limit + 1,)
+            )
+        else:
+            last_activity, session_id = json.loads(cursor)
+            rows = self._query(
+                """
+                SELECT session_id, created_at, last_activity
+                FROM sessions
+                WHERE last_activity < ? OR (last_activity = ? AND session_id < ?)
+                ORDER BY last_activity DESC, session_id DESC
+                LIMIT ?
+                """,
+                (last_activity, last_activity, session_id, limit + 1)
+            )
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        sessions = []
+        for row in rows:
+            sessions.append({
+                "session_id": row[0],
+                "created_at": row[1],
+                "last_activity": row[2]
+            })
+
+        next_cursor = json.dumps([rows[-1][2], rows[-1][0]]) if has_more else None
+        return {"sessions": sessions, "next_cursor": next_cursor}
+
+
+class AsyncChatDatabase:
+    """Awaitable facade over ChatDatabase for the ASGI app.
+
+    Calls run on a small dedicated thread pool, so the event loop never blocks on
+    SQLite; the threads borrow connections from the database's pool.
+    """
+
+    def __init__(self, db: ChatDatabase, max_workers: int = 4):
+        self.db = db
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="chat-db")
+
+    async def _run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: fn(*args, **kwargs))
+
+    async def create_session(self, session_id: str) -> bool:
+        return await self._run(self.db.create_session, session_id)
+
+    async def add_message(self, session_id: str, role: str, content: str) -> bool:
+        return await self._run(self.db.add_message, session_id, role, content)
+
+    async def get_session_history(self, session_id: str, limit: int = 50) -> List[Dict]:
+        return await self._run(self.db.get_session_history, session_id, limit=limit)
+
+    async def get_session_history_page(self, session_id: str, limit: int = 50,
+                                       before_id: Optional[int] = None) -> Dict:
+        return await self._run(self.db.get_session_history_page, session_id, limit=limit, before_id=before_id)
+
+    async def get_messages_after(self, session_id: str, after_id: int = 0, limit: int = 50) -> List[Dict]:
+        return await self._run(self.db.get_messages_after, session_id, after_id=after_id, limit=limit)
+
+    async def get_summary(self, session_id: str) -> Optional[Dict]:
+        return await self._run(self.db.get_summary, session_id)
+
+    async def save_summary(self, session_id: str, summary: str, summarized_through_id: int) -> bool:
+        return await self._run(self.db.save_summary, session_id, summary, summarized_through_id)
+
+    async def clear_session(self, session_id: str) -> bool:
+        return await self._run(self.db.clear_session, session_id)
+
+    async def get_sessions_page(self, limit: int = 50, cursor: Optional[str] = None) -> Dict:
+        return await self._run(self.db.get_sessions_page, limit=limit, cursor=cursor)
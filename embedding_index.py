@@ -0,0 +1,352 @@
+"""Memory-mapped index of soil image embeddings for nearest-neighbour lookup.
+
+The index directory holds ``vectors.f32``, a raw (count, dim) float32 matrix of
+L2-normalised embeddings that is memory-mapped at query time, and ``index.json``
+with one entry (path, label, size, mtime) per row. Rebuilding only embeds files
+that are new or changed since the last build: new rows are appended in place, and
+the matrix is only rewritten when reference images were changed or removed.
+
+Exact search scores every row, so it costs O(rows x dim) per query. With
+``--ivf-lists N`` the build also writes ``ivf.npz``, an inverted file: k-means
+centroids and the rows assigned to each. A query then only scores the rows of
+the ``nprobe`` lists whose centroids are closest to it. That is approximate, but
+it costs a small fraction of exact search.
+
+Usage:
+    python embedding_index.py build [--images "Soil types"] [--index embedding_index] [--ivf-lists 1024]
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from image_batch import IMAGE_EXTENSIONS, decode_batch
+
+VECTORS_FILE = "vectors.f32"
+MANIFEST_FILE = "index.json"
+IVF_FILE = "ivf.npz"
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0.0] = 1.0
+    return vectors / norms
+
+
+def scan_images(images_dir: str) -> Dict[str, dict]:
+    """Map each image's path relative to ``images_dir`` to its label (sub-directory), size and mtime"""
+    found = {}
+    for root, dirs, files in os.walk(images_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if name.startswith(".") or not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            relpath = os.path.relpath(path, images_dir).replace(os.sep, "/")
+            found[relpath] = {
+                "path": relpath,
+                "label": relpath.split("/")[0] if "/" in relpath else None,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+            }
+    return found
+
+
+def index_stamp(index_dir: str) -> tuple:
+    """Modification times of the manifest and IVF file; they change whenever a build updates the index"""
+    stamp = []
+    for name in (MANIFEST_FILE, IVF_FILE):
+        try:
+            stamp.append(os.stat(os.path.join(index_dir, name)).st_mtime_ns)
+        except FileNotFoundError:
+            stamp.append(None)
+    return tuple(stamp)
+
+
+def kmeans(vectors: np.ndarray, lists: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """L2-normalised centroids of ``lists`` spherical k-means clusters of the rows of ``vectors``"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), lists, replace=False)]
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        counts = np.bincount(assignment, minlength=lists)
+        order = np.argsort(assignment, kind="stable")
+        nonempty = np.flatnonzero(counts)
+        sums = np.zeros_like(centroids)
+        sums[nonempty] = np.add.reduceat(vectors[order], (np.cumsum(counts) - counts)[nonempty])
+        # Restart empty clusters from random rows
+        empty = np.flatnonzero(counts == 0)
+        sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+def build_ivf(index_dir: str, lists: Optional[int] = None, retrain: bool = False,
+              sample_per_list: int = 32, chunk_rows: int = 65536) -> dict:
+    """Write ``ivf.npz`` for the index in ``index_dir``; returns build statistics.
+
+    Centroids from an existing IVF file are reused when ``lists`` is unchanged, so an
+    incremental build only assigns rows to lists. ``retrain`` fits new centroids.
+    """
+    index = EmbeddingIndex(index_dir, use_ivf=False)
+    ivf_path = os.path.join(index_dir, IVF_FILE)
+    started = time.perf_counter()
+
+    centroids = None
+    if os.path.exists(ivf_path) and not retrain:
+        with np.load(ivf_path) as ivf:
+            if ivf["centroids"].shape[1] == index.dim and lists in (None, ivf["centroids"].shape[0]):
+                centroids = ivf["centroids"]
+    trained = centroids is None
+    if trained:
+        if not lists:
+            raise ValueError("Pass the number of IVF lists to build a new IVF file")
+        lists = min(lists, len(index))
+        rng = np.random.default_rng(0)
+        # k-means only needs a few dozen rows per centroid
+        sample = np.sort(rng.choice(len(index), min(sample_per_list * lists, len(index)), replace=False))
+        centroids = kmeans(np.asarray(index.vectors[sample]), lists)
+
+    assignment = np.empty(len(index), dtype=np.int32)
+    for start in range(0, len(index), chunk_rows):
+        assignment[start:start + chunk_rows] = np.argmax(index.vectors[start:start + chunk_rows] @ centroids.T, axis=1)
+    counts = np.bincount(assignment, minlength=len(centroids))
+
+    tmp_path = ivf_path + ".tmp"
+    with open(tmp_path, "wb") as file:
+        np.savez(
+            file,
+            centroids=centroids.astype(np.float32),
+            # Rows grouped by list: rows[offsets[i]:offsets[i + 1]] belong to list i
+            rows=np.argsort(assignment, kind="stable").astype(np.int32),
+            offsets=np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+            count=np.array(len(index), dtype=np.int64),
+        )
+    os.replace(tmp_path, ivf_path)
+    return {
+        "lists": int(len(centroids)),
+        "trained": trained,
+        "largest_list": int(counts.max()) if len(counts) else 0,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+class EmbeddingIndex:
+    """Cosine-similarity search over the embeddings in an index directory.
+
+    Searches through the IVF file when there is one that covers every row, scoring
+    the rows of the ``nprobe`` closest lists; otherwise every row is scored.
+    """
+
+    def __init__(self, index_dir: str, nprobe: int = 32, use_ivf: bool = True):
+        self.index_dir = index_dir
+        self.stamp = index_stamp(index_dir)
+        with open(os.path.join(index_dir, MANIFEST_FILE)) as file:
+            manifest = json.load(file)
+        self.dim = manifest["dim"]
+        self.model_sha256 = manifest.get("model_sha256")
+        self.entries = manifest["entries"]
+        self.labels = sorted({entry["label"] for entry in self.entries if entry["label"]})
+        label_ids = {label: index for index, label in enumerate(self.labels)}
+        self._label_ids = np.array([label_ids.get(entry["label"], -1) for entry in self.entries], dtype=np.int32)
+
+        if self.entries:
+            # Rows beyond the manifest's count are left over from an interrupted build and ignored
+            self.vectors = np.memmap(os.path.join(index_dir, VECTORS_FILE), dtype=np.float32, mode="r",
+                                     shape=(len(self.entries), self.dim))
+        else:
+            self.vectors = np.empty((0, self.dim or 0), dtype=np.float32)
+
+        self.nprobe = nprobe
+        self.ivf = None
+        ivf_path = os.path.join(index_dir, IVF_FILE)
+        if use_ivf and self.entries and os.path.exists(ivf_path):
+            with np.load(ivf_path) as ivf:
+                # An IVF file from before the last build does not cover the new rows
+                if int(ivf["count"]) == len(self.entries) and ivf["centroids"].shape[1] == self.dim:
+                    self.ivf = {name: ivf[name] for name in ("centroids", "rows", "offsets")}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def is_stale(self) -> bool:
+        """Whether the index directory was updated since this index was loaded"""
+        return index_stamp(self.index_dir) != self.stamp
+
+    def search(self, query: np.ndarray, k: int = 5, label: Optional[str] = None, exact: bool = False) -> List[dict]:
+        """Return the ``k`` entries most similar to ``query``, optionally restricted to one label.
+
+        ``exact`` scores every row even when there is an IVF file.
+        """
+        query = normalize_rows(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+        if query.shape[0] != self.dim:
+            raise ValueError(f"Expected a {self.dim}-dimensional embedding, got {query.shape[0]}")
+        if label is not None and label not in self.labels:
+            return []
+
+        if self.ivf is None or exact:
+            rows = np.arange(len(self.entries))
+            scores = np.asarray(self.vectors @ query)
+        else:
+            centroids, offsets = self.ivf["centroids"], self.ivf["offsets"]
+            nprobe = min(self.nprobe, len(centroids))
+            probes = np.argpartition(-(centroids @ query), nprobe - 1)[:nprobe]
+            # Sorted rows read the memory-mapped matrix front to back
+            rows = np.sort(np.concatenate([self.ivf["rows"][offsets[probe]:offsets[probe + 1]] for probe in probes]))
+            scores = np.asarray(self.vectors[rows] @ query)
+        if label is not None:
+            scores = np.where(self._label_ids[rows] == self.labels.index(label), scores, -np.inf)
+
+        k = min(k, scores.shape[0])
+        if k <= 0:
+            return []
+        top = np.argpartition(scores, scores.shape[0] - k)[-k:]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [
+            {"path": self.entries[rows[i]]["path"], "label": self.entries[rows[i]]["label"],
+             "score": round(float(scores[i]), 6)}
+            for i in top if np.isfinite(scores[i])
+        ]
+
+
+def build_index(images_dir: str, index_dir: str, embed: Callable[[np.ndarray], np.ndarray],
+                preprocess: Callable[..., np.ndarray], image_size=(224, 224), batch_size: int = 32,
+                model_sha256: Optional[str] = None, decode_workers: Optional[int] = None,
+                ivf_lists: Optional[int] = None, retrain_ivf: bool = False) -> dict:
+    """Create or update the index for every image under ``images_dir``; returns build statistics.
+
+    An existing IVF file is kept up to date; ``ivf_lists`` creates (or resizes) one.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    manifest_path = os.path.join(index_dir, MANIFEST_FILE)
+    vectors_path = os.path.join(index_dir, VECTORS_FILE)
+
+    old_entries, old_vectors, dim = [], None, None
+    if os.path.exists(manifest_path):
+        old = EmbeddingIndex(index_dir, use_ivf=False)
+        if model_sha256 and old.model_sha256 and old.model_sha256 != model_sha256:
+            print("Index was built with a different model, re-embedding every image")
+        else:
+            old_entries, old_vectors, dim = old.entries, old.vectors, old.dim
+
+    def write_manifest():
+        tmp_path = manifest_path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump({"dim": dim, "model_sha256": model_sha256, "entries": entries}, file)
+        os.replace(tmp_path, manifest_path)
+
+    current = scan_images(images_dir)
+    unchanged = [
+        (row, entry) for row, entry in enumerate(old_entries)
+        if current.get(entry["path"], {}).get("size") == entry["size"]
+        and current[entry["path"]]["mtime_ns"] == entry["mtime_ns"]
+    ]
+    kept_paths = {entry["path"] for _, entry in unchanged}
+    pending = [entry for path, entry in current.items() if path not in kept_paths]
+    append_only = len(unchanged) == len(old_entries)
+
+    entries = [entry for _, entry in unchanged]
+    # Rows an interrupted build (or an index for another model) left beyond the manifest's count
+    leftover_rows = os.path.exists(vectors_path) and \
+        os.path.getsize(vectors_path) != len(entries) * (dim or 0) * 4
+    if append_only and not leftover_rows:
+        if os.path.exists(manifest_path) and not entries:
+            write_manifest()
+    else:
+        # Copy the surviving rows into a fresh matrix and swap it in, never shrinking the file
+        # a running server has memory-mapped; new rows are appended to it below
+        tmp_path = vectors_path + ".tmp"
+        with open(tmp_path, "wb") as file:
+            for start in range(0, len(unchanged), 4096):
+                rows = [row for row, _ in unchanged[start:start + 4096]]
+                file.write(np.ascontiguousarray(old_vectors[rows]).tobytes())
+        old_vectors = None
+        os.replace(tmp_path, vectors_path)
+        write_manifest()
+
+    started = time.perf_counter()
+    failed = []
+    buffer = np.empty((batch_size, image_size[1], image_size[0], 3), dtype=np.float32)
+    with ThreadPoolExecutor(max_workers=decode_workers or os.cpu_count() or 4) as executor, \
+            open(vectors_path, "ab") as vectors_file:
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start:start + batch_size]
+            items = [(entry["path"], lambda entry=entry: _read(images_dir, entry["path"])) for entry in chunk]
+            decoded = decode_batch(items, preprocess, executor, buffer)
+            valid = [index for index, (_, error) in enumerate(decoded) if error is None]
+            failed.extend({"path": name, "error": error} for name, error in decoded if error is not None)
+            if not valid:
+                continue
+
+            vectors = normalize_rows(embed(buffer[valid]))
+            if dim is None:
+                dim = int(vectors.shape[1])
+            vectors_file.write(vectors.tobytes())
+            vectors_file.flush()
+            entries.extend(chunk[index] for index in valid)
+            # Saved after every batch so an interrupted build resumes where it stopped
+            write_manifest()
+
+    if dim is not None:
+        write_manifest()
+    seconds = time.perf_counter() - started
+    embedded = len(pending) - len(failed)
+    ivf_path = os.path.join(index_dir, IVF_FILE)
+    ivf = None
+    if entries and (ivf_lists or os.path.exists(ivf_path)):
+        ivf = build_ivf(index_dir, ivf_lists, retrain=retrain_ivf)
+    elif os.path.exists(ivf_path):
+        os.remove(ivf_path)
+    return {
+        "images": len(entries),
+        "reused": len(unchanged),
+        "embedded": embedded,
+        "removed_or_changed": len(old_entries) - len(unchanged),
+        "failed": failed,
+        "dim": dim,
+        "seconds": round(seconds, 3),
+        "images_per_second": round(embedded / seconds, 1) if seconds and embedded else None,
+        "ivf": ivf,
+    }
+
+
+def _read(images_dir: str, relpath: str) -> bytes:
+    with open(os.path.join(images_dir, relpath), "rb") as file:
+        return file.read()
+
+
+def main():
+    from app import IMAGE_SIZE, preprocess_image
+    from forest_engine import file_sha256
+    from inference_backends import KerasBackend
+
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Build the similar-soil embedding index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="embed new or changed reference images")
+    build_parser.add_argument("--images", default=os.environ.get("REFERENCE_IMAGES_DIR", os.path.join(base_dir, "Soil types")))
+    build_parser.add_argument("--index", default=os.environ.get("EMBEDDING_INDEX_PATH", os.path.join(base_dir, "embedding_index")))
+    build_parser.add_argument("--model", default=os.environ.get("MODEL_PATH", os.path.join(base_dir, "my_model.h5")))
+    build_parser.add_argument("--batch-size", type=int, default=32)
+    build_parser.add_argument("--ivf-lists", type=int, default=None,
+                              help="also write an IVF file with this many lists for approximate search "
+                                   "(about 4 x sqrt(images) is a good start)")
+    build_parser.add_argument("--retrain-ivf", action="store_true",
+                              help="fit new IVF centroids instead of reusing the existing ones")
+    args = parser.parse_args()
+
+    backend = KerasBackend(args.model)
+    report = build_index(args.images, args.index, backend.embed_on_batch, preprocess_image,
+                         image_size=IMAGE_SIZE, batch_size=args.batch_size, model_sha256=file_sha256(args.model),
+                         ivf_lists=args.ivf_lists, retrain_ivf=args.retrain_ivf)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Export the soil type model to TFLite and check the export against the Keras model.
+
+Usage:
+    python export_model.py export --output soil_model.tflite [--quantize float16|int8]
+    python export_model.py parity --tflite soil_model.tflite [--images "Soil types"]
+
+Serve the exported file with INFERENCE_BACKEND=tflite (see PROJECT_README.md).
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+from app import CLASS_NAMES, load_model, preprocess_image
+from inference_backends import KerasBackend, TFLiteBackend
+from training import list_labelled_images
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_image(path: str) -> np.ndarray:
+    with open(path, "rb") as file:
+        return preprocess_image(file.read())
+
+
+def export(args):
+    import tensorflow as tf
+
+    model = load_model(args.model)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+
+    if args.quantize == "float16":
+        # Halves the file size; weights are dequantized to float32 at load time
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif args.quantize == "int8":
+        # Full integer quantization, calibrated on a sample of the training images
+        images = list_labelled_images(args.calibration_dir)
+        if not images:
+            sys.exit(f"No calibration images found in '{args.calibration_dir}'")
+        random.Random(0).shuffle(images)
+        calibration = images[:args.calibration_samples]
+
+        def representative_dataset():
+            for path, _ in calibration:
+                yield [load_image(path)]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+
+    tflite_model = converter.convert()
+    with open(args.output, "wb") as file:
+        file.write(tflite_model)
+    print(json.dumps({
+        "output": args.output,
+        "quantize": args.quantize,
+        "bytes": len(tflite_model),
+        "source_bytes": os.path.getsize(args.model),
+    }, indent=2))
+
+
+def parity(args):
+    images = list_labelled_images(args.images)
+    if not images:
+        sys.exit(f"No images found in '{args.images}'")
+
+    backends = [KerasBackend(args.model), TFLiteBackend(args.tflite)]
+    predictions = {backend.name: [] for backend in backends}
+    logits = {backend.name: [] for backend in backends}
+    seconds = {backend.name: 0.0 for backend in backends}
+
+    for path, _ in images:
+        batch = load_image(path)
+        for backend in backends:
+            started = time.perf_counter()
+            output = backend.predict_on_batch(batch)[0]
+            seconds[backend.name] += time.perf_counter() - started
+            logits[backend.name].append(output)
+            predictions[backend.name].append(int(np.argmax(output)))
+
+    labels = np.array([label for _, label in images])
+    keras_predictions = np.array(predictions["keras"])
+    tflite_predictions = np.array(predictions["tflite"])
+    agreement = float(np.mean(keras_predictions == tflite_predictions))
+
+    report = {
+        "images": len(images),
+        "agreement": round(agreement, 4),
+        "keras_accuracy": round(float(np.mean(keras_predictions == labels)), 4),
+        "tflite_accuracy": round(float(np.mean(tflite_predictions == labels)), 4),
+        "max_abs_logit_diff": round(float(np.max(np.abs(np.array(logits["keras"]) - np.array(logits["tflite"])))), 6),
+        "keras_ms_per_image": round(seconds["keras"] * 1000 / len(images), 3),
+        "tflite_ms_per_image": round(seconds["tflite"] * 1000 / len(images), 3),
+        "disagreements": [
+            {"image": os.path.relpath(path, args.images),
+             "keras": CLASS_NAMES[keras_pred], "tflite": CLASS_NAMES[tflite_pred]}
+            for (path, _), keras_pred, tflite_pred in zip(images, keras_predictions, tflite_predictions)
+            if keras_pred != tflite_pred
+        ],
+    }
+    print(json.dumps(report, indent=2))
+
+    if agreement < args.min_agreement:
+        sys.exit(f"Top-1 agreement {agreement:.4f} is below --min-agreement {args.min_agreement}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default=os.environ.get("MODEL_PATH", os.path.join(BASE_DIR, "my_model.h5")),
+                        help="source Keras model (default: MODEL_PATH or ./my_model.h5)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="convert the Keras model to a .tflite file")
+    export_parser.add_argument("--output", default=os.path.join(BASE_DIR, "soil_model.tflite"))
+    export_parser.add_argument("--quantize", choices=["none", "float16", "int8"], default="none")
+    export_parser.add_argument("--calibration-dir", default=os.path.join(BASE_DIR, "Soil types"),
+                               help="images used to calibrate int8 quantization")
+    export_parser.add_argument("--calibration-samples", type=int, default=100)
+    export_parser.set_defaults(func=export)
+
+    parity_parser = subparsers.add_parser("parity", help="compare TFLite and Keras predictions on labelled images")
+    parity_parser.add_argument("--tflite", default=os.path.join(BASE_DIR, "soil_model.tflite"))
+    parity_parser.add_argument("--images", default=os.path.join(BASE_DIR, "Soil types"))
+    parity_parser.add_argument("--min-agreement", type=float, default=0.98,
+                               help="exit non-zero when top-1 agreement with Keras is below this")
+    parity_parser.set_defaults(func=parity)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import csv
+import io
+import json
+import os
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+def detect_format(filename: str = "", content_type: str = "", requested: str = "") -> str:
+    """Pick 'csv' or 'ndjson' from an explicit format, the file extension or the content type"""
+    requested = (requested or "").lower()
+    if requested in ("csv", "ndjson"):
+        return requested
+    filename = (filename or "").lower()
+    if filename.endswith((".ndjson", ".jsonl", ".json")):
+        return "ndjson"
+    if filename.endswith(".csv"):
+        return "csv"
+    content_type = (content_type or "").lower()
+    if "ndjson" in content_type or "jsonl" in content_type or "json" in content_type:
+        return "ndjson"
+    return "csv"
+
+
+def open_upload_stream(upload):
+    """Return a handle on an uploaded file that stays open after the request is torn down.
+
+    Flask closes ``request.files`` when the request context is popped, which happens
+    before a streamed response has finished reading the upload. By then Werkzeug has
+    already read the whole multipart body; send a raw body to stream large inputs.
+    """
+    stream = upload.stream
+    try:
+        # Spooled uploads roll over to an unlinked temporary file; a duplicated
+        # descriptor keeps it readable without copying it into memory
+        return os.fdopen(os.dup(stream.fileno()), "rb")
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return io.BytesIO(stream.read())
+
+
+def _decoded_lines(stream: Iterable[bytes]) -> Iterator[str]:
+    first = True
+    for line in stream:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8-sig" if first else "utf-8")
+        first = False
+        yield line
+
+
+def iter_records(stream: Iterable[bytes], fmt: str) -> Iterator[Tuple[int, Optional[Dict], Optional[str]]]:
+    """Yield (row number, record, parse error) one line at a time without buffering the whole upload"""
+    lines = _decoded_lines(stream)
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        for row_number, row in enumerate(reader, start=1):
+            # Drop padding from spreadsheet exports so blank cells count as missing fields
+            yield row_number, {key.strip(): value.strip() for key, value in row.items()
+                               if key is not None and value not in (None, "")}, None
+        return
+
+    row_number = 0
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        row_number += 1
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield row_number, None, f"Invalid JSON: {e.msg}"
+            continue
+        if not isinstance(record, dict):
+            yield row_number, None, "Each NDJSON line must be a JSON object"
+            continue
+        yield row_number, record, None
+
+
+def iter_chunks(iterable: Iterable, size: int) -> Iterator[List]:
+    """Group an iterable into lists of at most ``size`` items"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
@@ -0,0 +1,210 @@
+"""Flattened random forest inference for the fertility model.
+
+Converts the scikit-learn forest in random_forest_pkl.pkl into a handful of
+contiguous NumPy arrays and evaluates every tree for a whole batch at once.
+
+Usage:
+    python forest_engine.py random_forest_pkl.pkl random_forest.npz
+"""
+import argparse
+import hashlib
+import json
+import pickle
+import sys
+import time
+from typing import Optional
+
+import numpy as np
+
+
+def flatten_forest(forest) -> dict:
+    """Concatenate the nodes of every tree in a fitted RandomForestClassifier into flat arrays.
+
+    Child indices are rebased into the combined node array. Leaves point back at
+    themselves with an infinite threshold, so traversal can run a fixed number of
+    steps without checking which rows have already reached a leaf.
+    """
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for estimator in forest.estimators_:
+        tree = estimator.tree_
+        nodes = np.arange(tree.node_count)
+        is_leaf = tree.children_left == -1
+
+        features.append(np.where(is_leaf, 0, tree.feature))
+        thresholds.append(np.where(is_leaf, np.inf, tree.threshold))
+        lefts.append(np.where(is_leaf, nodes, tree.children_left) + offset)
+        rights.append(np.where(is_leaf, nodes, tree.children_right) + offset)
+        # Per-node class distribution, normalised like DecisionTreeClassifier.predict_proba
+        value = tree.value[:, 0, :]
+        totals = value.sum(axis=1, keepdims=True)
+        totals[totals == 0.0] = 1.0
+        values.append(value / totals)
+
+        roots.append(offset)
+        offset += tree.node_count
+        max_depth = max(max_depth, tree.max_depth)
+
+    return {
+        "feature": np.concatenate(features).astype(np.int32),
+        "threshold": np.concatenate(thresholds).astype(np.float64),
+        "left": np.concatenate(lefts).astype(np.int32),
+        "right": np.concatenate(rights).astype(np.int32),
+        "value": np.concatenate(values).astype(np.float64),
+        "roots": np.array(roots, dtype=np.int32),
+        "max_depth": np.array(max_depth, dtype=np.int32),
+        "classes": np.asarray(forest.classes_),
+        "n_features": np.array(forest.n_features_in_, dtype=np.int32),
+    }
+
+
+class ForestEngine:
+    """Evaluates a flattened forest; predictions match RandomForestClassifier.predict"""
+
+    def __init__(self, arrays: dict):
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.left = arrays["left"]
+        self.right = arrays["right"]
+        self.value = arrays["value"]
+        self.roots = arrays["roots"]
+        self.max_depth = int(arrays["max_depth"])
+        self.classes_ = arrays["classes"]
+        self.n_features_in_ = int(arrays["n_features"])
+        # Hash of the pickle this engine was converted from, when known
+        self.source_sha256 = str(arrays["source_sha256"]) if "source_sha256" in arrays else None
+
+    @classmethod
+    def from_sklearn(cls, forest) -> "ForestEngine":
+        return cls(flatten_forest(forest))
+
+    @classmethod
+    def load(cls, path: str) -> "ForestEngine":
+        with np.load(path) as arrays:
+            return cls({name: arrays[name] for name in arrays.files})
+
+    def save(self, path: str):
+        np.savez(
+            path,
+            feature=self.feature,
+            threshold=self.threshold,
+            left=self.left,
+            right=self.right,
+            value=self.value,
+            roots=self.roots,
+            max_depth=np.array(self.max_depth, dtype=np.int32),
+            classes=self.classes_,
+            n_features=np.array(self.n_features_in_, dtype=np.int32),
+            **({"source_sha256": np.array(self.source_sha256)} if self.source_sha256 else {}),
+        )
+
+    def apply(self, X) -> np.ndarray:
+        """Return the (n_samples, n_trees) leaf node index reached in every tree"""
+        # scikit-learn trees compare float32 features against float64 thresholds
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"Expected an array of shape (n, {self.n_features_in_}), got {X.shape}")
+        # NaN compares False and would silently take the right branch; reject it like scikit-learn
+        if np.isnan(X).any():
+            raise ValueError("Input X contains NaN.")
+        if not np.isfinite(X).all():
+            raise ValueError("Input X contains infinity or a value too large for dtype('float32').")
+
+        rows = np.arange(X.shape[0])[:, None]
+        nodes = np.broadcast_to(self.roots, (X.shape[0], self.roots.shape[0]))
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return nodes
+
+    def predict_proba(self, X) -> np.ndarray:
+        leaf_values = self.value[self.apply(X)]
+        # Accumulate tree by tree, in the same order and precision as scikit-learn,
+        # so near-ties resolve to the same class
+        proba = np.zeros((leaf_values.shape[0], leaf_values.shape[2]), dtype=np.float64)
+        for tree in range(leaf_values.shape[1]):
+            proba += leaf_values[:, tree, :]
+        proba /= leaf_values.shape[1]
+        return proba
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1), axis=0)
+
+
+def file_sha256(path: str) -> str:
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def non_finite_parity(forest, engine) -> bool:
+    """True when the engine rejects NaN and infinite rows with the same ValueError as scikit-learn"""
+    for value in (np.nan, np.inf, -np.inf, 1e300):
+        row = np.zeros((1, engine.n_features_in_))
+        row[0, -1] = value
+        errors = []
+        for predict in (forest.predict, engine.predict):
+            try:
+                predict(row)
+                errors.append(None)
+            except ValueError as error:
+                errors.append(str(error).splitlines()[0])
+        if errors[0] is None or errors[0] != errors[1]:
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a pickled random forest into a ForestEngine .npz file")
+    parser.add_argument("source", help="pickled RandomForestClassifier")
+    parser.add_argument("output", help="destination .npz file")
+    parser.add_argument("--check-rows", type=int, default=10000,
+                        help="random rows used to verify the engine against scikit-learn (0 to skip)")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    with open(args.source, "rb") as file:
+        forest = pickle.load(file)
+    pickle_load_seconds = time.perf_counter() - started
+
+    engine = ForestEngine.from_sklearn(forest)
+    engine.source_sha256 = file_sha256(args.source)
+    engine.save(args.output)
+
+    started = time.perf_counter()
+    engine = ForestEngine.load(args.output)
+    report = {
+        "trees": int(engine.roots.shape[0]),
+        "nodes": int(engine.feature.shape[0]),
+        "max_depth": engine.max_depth,
+        "pickle_load_ms": round(pickle_load_seconds * 1000, 3),
+        "engine_load_ms": round((time.perf_counter() - started) * 1000, 3),
+    }
+
+    mismatches: Optional[int] = None
+    if args.check_rows:
+        # Log-scale features spanning the range the app produces from raw nutrient values
+        rng = np.random.default_rng(0)
+        X = rng.uniform(-3.0, 10.0, size=(args.check_rows, engine.n_features_in_))
+        expected = forest.predict(X)
+        mismatches = int(np.sum(engine.predict(X) != expected))
+        report["check_rows"] = args.check_rows
+        report["mismatches"] = mismatches
+        report["non_finite_rejected"] = non_finite_parity(forest, engine)
+
+        single = X[:1]
+        for name, predict in (("sklearn", forest.predict), ("engine", engine.predict)):
+            started = time.perf_counter()
+            for _ in range(100):
+                predict(single)
+            report[f"{name}_single_row_ms"] = round((time.perf_counter() - started) * 10, 3)
+
+    print(json.dumps(report, indent=2))
+    if mismatches:
+        sys.exit(f"{mismatches} of {args.check_rows} predictions differ from scikit-learn")
+    if args.check_rows and not report["non_finite_rejected"]:
+        sys.exit("Non-finite input is not rejected the same way as scikit-learn")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+from types import SimpleNamespace
+from typing import Callable, Optional, Union
+
+
+def _content_bytes(part) -> bytes:
+    """Stable byte representation of one prompt part (text, raw bytes or a PIL image)"""
+    if isinstance(part, str):
+        return b"text:" + part.encode("utf-8")
+    if isinstance(part, (bytes, bytearray)):
+        return b"bytes:" + bytes(part)
+    if hasattr(part, "tobytes") and hasattr(part, "mode") and hasattr(part, "size"):
+        # PIL image: hash the decoded pixels so re-encoded uploads of the same photo match
+        header = f"image:{part.mode}:{part.size[0]}x{part.size[1]}:".encode("utf-8")
+        return header + part.tobytes()
+    return b"repr:" + repr(part).encode("utf-8")
+
+
+def prompt_fingerprint(model: str, contents, config=None) -> str:
+    """SHA-256 over the model name, every prompt part and any generation config"""
+    digest = hashlib.sha256()
+    digest.update(f"model:{model}\n".encode("utf-8"))
+    parts = contents if isinstance(contents, (list, tuple)) else [contents]
+    for part in parts:
+        data = _content_bytes(part)
+        digest.update(len(data).to_bytes(8, "big"))
+        digest.update(data)
+    if config is not None:
+        digest.update(b"config:" + repr(config).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class GeminiResponseCache:
+    """SQLite-backed store of Gemini response text, evicting least recently used entries by total size"""
+
+    def __init__(self, db_path: str = "gemini_cache.db", max_bytes: int = 64 * 1024 * 1024):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS gemini_responses (
+                fingerprint TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response_text TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_gemini_responses_last_access ON gemini_responses (last_access)"
+        )
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, fingerprint: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response_text FROM gemini_responses WHERE fingerprint = ?", (fingerprint,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE gemini_responses SET last_access = ? WHERE fingerprint = ?", (time.time(), fingerprint)
+            )
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, fingerprint: str, model: str, response_text: str):
+        size = len(response_text.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO gemini_responses "
+                "(fingerprint, model, response_text, size, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                (fingerprint, model, response_text, size, now, now)
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM gemini_responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        cursor = self._conn.execute("SELECT fingerprint, size FROM gemini_responses ORDER BY last_access ASC")
+        doomed = []
+        for fingerprint, size in cursor:
+            if total <= self.max_bytes:
+                break
+            doomed.append((fingerprint,))
+            total -= size
+        self._conn.executemany("DELETE FROM gemini_responses WHERE fingerprint = ?", doomed)
+        self.evictions += len(doomed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM gemini_responses"
+            ).fetchone()
+            return {
+                "entries": entries,
+                "bytes": total,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class CachedGeminiClient:
+    """Drop-in wrapper exposing ``models.generate_content`` that answers repeated prompts from a cache.
+
+    Only use it for deterministic prompts; the response object it returns carries just ``text``.
+    """
+
+    def __init__(self, client, cache: GeminiResponseCache):
+        self.client = client
+        self.cache = cache
+        self.models = SimpleNamespace(generate_content=self.generate_content)
+        # Mirrors the SDK's client.aio for async callers
+        self.aio = SimpleNamespace(models=SimpleNamespace(generate_content=self.generate_content_async))
+
+    def generate_content(self, model: str, contents, config=None, **kwargs):
+        fingerprint = prompt_fingerprint(model, contents, config)
+        cached = self.cache.get(fingerprint)
+        if cached is not None:
+            return SimpleNamespace(text=cached, cached=True)
+
+        if config is not None:
+            kwargs["config"] = config
+        response = self.client.models.generate_content(model=model, contents=contents, **kwargs)
+        text = response.text
+        if text:
+            self.cache.set(fingerprint, model, text)
+        return response
+
+    async def generate_content_async(self, model: str, contents, config=None, **kwargs):
+        # Hashing image pixels and the SQLite lookup both block, so they run off the event loop
+        fingerprint = await asyncio.to_thread(prompt_fingerprint, model, contents, config)
+        cached = await asyncio.to_thread(self.cache.get, fingerprint)
+        if cached is not None:
+            return SimpleNamespace(text=cached, cached=True)
+
+        if config is not None:
+            kwargs["config"] = config
+        response = await self.client.aio.models.generate_content(model=model, contents=contents, **kwargs)
+        text = response.text
+        if text:
+            await asyncio.to_thread(self.cache.set, fingerprint, model, text)
+        return response
+
+
+class FakeGeminiClient:
+    """Offline stand-in for ``genai.Client`` that returns canned text and records every call.
+
+    ``responses`` may be a fixed string or a callable taking (model, contents) and
+    returning the response text.
+    """
+
+    def __init__(self, responses: Union[str, Callable[[str, object], str]] = "{}", latency: float = 0.0):
+        self.responses = responses
+        self.latency = latency
+        self.calls = []
+        self.models = SimpleNamespace(
+            generate_content=self.generate_content,
+            generate_content_stream=self.generate_content_stream,
+        )
+        self.aio = SimpleNamespace(models=SimpleNamespace(
+            generate_content=self.generate_content_async,
+            generate_content_stream=self.generate_content_stream_async,
+        ))
+
+    def generate_content(self, model: str, contents, **kwargs):
+        self.calls.append({"model": model, "contents": contents, **kwargs})
+        if self.latency:
+            time.sleep(self.latency)
+        text = self.responses(model, contents) if callable(self.responses) else self.responses
+        return SimpleNamespace(text=text)
+
+    def generate_content_stream(self, model: str, contents, chunk_words: int = 4, **kwargs):
+        """Yield the canned response a few words at a time, after the same initial latency"""
+        words = self.generate_content(model, contents, **kwargs).text.split(" ")
+        for start in range(0, len(words), chunk_words):
+            text = " ".join(words[start:start + chunk_words])
+            yield SimpleNamespace(text=text if start + chunk_words >= len(words) else text + " ")
+
+    async def generate_content_async(self, model: str, contents, **kwargs):
+        self.calls.append({"model": model, "contents": contents, **kwargs})
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        text = self.responses(model, contents) if callable(self.responses) else self.responses
+        return SimpleNamespace(text=text)
+
+    async def generate_content_stream_async(self, model: str, contents, chunk_words: int = 4, **kwargs):
+        """Like the SDK, awaiting this returns an async iterator of chunks"""
+        response = await self.generate_content_async(model, contents, **kwargs)
+        words = response.text.split(" ")
+
+        async def chunks():
+            for start in range(0, len(words), chunk_words):
+                text = " ".join(words[start:start + chunk_words])
+                yield SimpleNamespace(text=text if start + chunk_words >= len(words) else text + " ")
+
+        return chunks()
@@ -0,0 +1,68 @@
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp", ".tif", ".tiff")
+
+
+def is_zip_upload(upload) -> bool:
+    filename = (upload.filename or "").lower()
+    content_type = (upload.mimetype or "").lower()
+    return filename.endswith(".zip") or content_type in ("application/zip", "application/x-zip-compressed")
+
+
+def iter_uploaded_images(uploads, max_files: int, max_zip_bytes: int) -> Iterator[Tuple[str, Callable[[], bytes]]]:
+    """Yield (name, read) pairs for every image in a list of uploads, expanding zip archives.
+
+    ``read`` returns the image bytes and is only called when the image is about to be
+    decoded, so archive members are not all inflated into memory up front.
+    """
+    count = 0
+    for upload in uploads:
+        if not upload or upload.filename == "":
+            continue
+
+        if is_zip_upload(upload):
+            archive = zipfile.ZipFile(upload.stream)
+            members = [
+                info for info in archive.infolist()
+                if not info.is_dir()
+                and not os.path.basename(info.filename).startswith(".")
+                and info.filename.lower().endswith(IMAGE_EXTENSIONS)
+            ]
+            total_size = sum(info.file_size for info in members)
+            if total_size > max_zip_bytes:
+                raise ValueError(
+                    f"Archive '{upload.filename}' expands to {total_size} bytes, limit is {max_zip_bytes}"
+                )
+            for info in sorted(members, key=lambda info: info.filename):
+                count += 1
+                if count > max_files:
+                    raise ValueError(f"Too many images in request, limit is {max_files}")
+                yield info.filename, (lambda info=info: archive.read(info))
+        else:
+            count += 1
+            if count > max_files:
+                raise ValueError(f"Too many images in request, limit is {max_files}")
+            yield upload.filename, upload.read
+
+
+def decode_batch(items: List[Tuple[str, Callable[[], bytes]]], preprocess: Callable[..., np.ndarray],
+                 executor: ThreadPoolExecutor, out: np.ndarray) -> List[Tuple[str, Optional[str]]]:
+    """Read and preprocess a batch of images on the worker pool, writing image ``i`` into ``out[i]``.
+
+    Returns (name, error) per image, where error is None when decoding succeeded.
+    """
+    def decode(indexed_item):
+        index, (name, read) = indexed_item
+        try:
+            preprocess(read(), out=out[index])
+            return name, None
+        except Exception as e:
+            return name, f"Failed to process image: {str(e)}"
+
+    return list(executor.map(decode, enumerate(items)))
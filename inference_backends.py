@@ -0,0 +1,110 @@
+import threading
+from typing import Optional
+
+import numpy as np
+
+
+class KerasBackend:
+    """Runs the original tf_keras model (with its TensorFlow Hub layer)"""
+
+    name = "keras"
+
+    def __init__(self, model_path: str, intra_op_threads: Optional[int] = None,
+                 inter_op_threads: Optional[int] = None):
+        # CRITICAL: Import tf_keras before tensorflow to ensure Keras 2.x compatibility
+        import tf_keras
+        import tensorflow_hub as hub
+        import tensorflow as tf
+
+        # Thread pool sizes only take effect before TensorFlow's runtime is initialised
+        try:
+            if intra_op_threads:
+                tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+            if inter_op_threads:
+                tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+        except RuntimeError as e:
+            print(f"Warning: could not limit TensorFlow threads: {e}")
+
+        self.model_path = model_path
+        self.model = tf_keras.models.load_model(model_path, custom_objects={"KerasLayer": hub.KerasLayer})
+        # Same weights, stopping at the penultimate layer (the input to the softmax)
+        self.embedding_model = tf_keras.Model(inputs=self.model.inputs, outputs=self.model.layers[-2].output)
+
+    def predict_on_batch(self, batch: np.ndarray) -> np.ndarray:
+        return np.asarray(self.model.predict_on_batch(batch))
+
+    def embed_on_batch(self, batch: np.ndarray) -> np.ndarray:
+        """Return the (n, dim) penultimate-layer embeddings used by the similar-soil index"""
+        return np.asarray(self.embedding_model.predict_on_batch(batch))
+
+
+class TFLiteBackend:
+    """Runs an exported .tflite model with the TFLite interpreter.
+
+    Uses the standalone ``tflite_runtime`` package when it is installed, so a serving
+    image does not need full TensorFlow, and falls back to ``tf.lite`` otherwise.
+    Quantized (int8) inputs and outputs are converted to and from float32 here, so
+    callers see the same logits as with the Keras backend.
+    """
+
+    name = "tflite"
+
+    def __init__(self, model_path: str, num_threads: Optional[int] = None):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+
+        self.model_path = model_path
+        self.interpreter = Interpreter(model_path=model_path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self._input["shape"][0])
+        # The interpreter holds per-call state, so calls from different threads are serialised
+        self._lock = threading.Lock()
+
+    def _resize(self, batch_size: int):
+        shape = list(self._input["shape"])
+        shape[0] = batch_size
+        self.interpreter.resize_tensor_input(self._input["index"], shape)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = batch_size
+
+    def predict_on_batch(self, batch: np.ndarray) -> np.ndarray:
+        batch = np.asarray(batch, dtype=np.float32)
+        with self._lock:
+            if batch.shape[0] != self._batch_size:
+                self._resize(batch.shape[0])
+
+            input_dtype = self._input["dtype"]
+            if input_dtype != np.float32:
+                scale, zero_point = self._input["quantization"]
+                info = np.iinfo(input_dtype)
+                batch = np.clip(np.round(batch / scale + zero_point), info.min, info.max).astype(input_dtype)
+            self.interpreter.set_tensor(self._input["index"], batch)
+            self.interpreter.invoke()
+            output = self.interpreter.get_tensor(self._output["index"])
+
+            if output.dtype != np.float32:
+                scale, zero_point = self._output["quantization"]
+                output = (output.astype(np.float32) - zero_point) * scale
+            # get_tensor returns a view into interpreter memory that the next invoke overwrites
+            return np.array(output, dtype=np.float32)
+
+
+BACKENDS = {
+    KerasBackend.name: KerasBackend,
+    TFLiteBackend.name: TFLiteBackend,
+}
+
+
+def load_backend(name: str, model_path: str, **options):
+    """Instantiate the inference backend called ``name`` ("keras" or "tflite")"""
+    try:
+        backend_class = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown inference backend '{name}', expected one of: {', '.join(BACKENDS)}")
+    return backend_class(model_path, **options)
@@ -0,0 +1,81 @@
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional
+
+
+class LazyResource:
+    """Loads an expensive object on first use, exactly once, from whichever thread needs it first.
+
+    A failed load is remembered (see ``status``) and retried on the next ``get``.
+    """
+
+    def __init__(self, name: str, loader: Callable[[], object], warmup: Optional[Callable[[object], None]] = None):
+        self.name = name
+        self._loader = loader
+        self._warmup = warmup
+        self._lock = threading.Lock()
+        self._value = None
+        self._loaded = False
+        self.load_seconds = None
+        self.error = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def get(self):
+        if self._loaded:
+            return self._value
+        with self._lock:
+            if not self._loaded:
+                started = time.perf_counter()
+                try:
+                    value = self._loader()
+                    if self._warmup is not None:
+                        self._warmup(value)
+                except Exception as e:
+                    self.error = str(e)
+                    raise
+                self._value = value
+                self.load_seconds = round(time.perf_counter() - started, 3)
+                self.error = None
+                self._loaded = True
+        return self._value
+
+    def preload(self, value):
+        """Use an object that was loaded elsewhere instead of calling the loader"""
+        with self._lock:
+            self._value = value
+            self.load_seconds = 0.0
+            self.error = None
+            self._loaded = True
+
+    def status(self) -> Dict:
+        return {"loaded": self._loaded, "load_seconds": self.load_seconds, "error": self.error}
+
+
+class LazyProxy:
+    """Attribute-forwarding stand-in for an object behind a LazyResource"""
+
+    def __init__(self, resource: LazyResource):
+        self._resource = resource
+
+    def __getattr__(self, name):
+        return getattr(self._resource.get(), name)
+
+
+def start_warmup(resources: Iterable[LazyResource]) -> threading.Thread:
+    """Load resources one after another on a daemon thread so the first request does not pay for them"""
+    resources = list(resources)
+
+    def run():
+        for resource in resources:
+            try:
+                resource.get()
+                print(f"Warm-up: loaded {resource.name} in {resource.load_seconds}s")
+            except Exception as e:
+                print(f"Warning: warm-up failed to load {resource.name}: {e}")
+
+    thread = threading.Thread(target=run, name="model-warmup", daemon=True)
+    thread.start()
+    return thread
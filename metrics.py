@@ -0,0 +1,267 @@
+"""In-process request and stage metrics rendered in the Prometheus text exposition format.
+
+Metrics live in the process that records them; when several worker processes serve
+the app, scrape each one (or aggregate them) separately.
+"""
+import functools
+import math
+import threading
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+from typing import Dict, Iterable, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.type_name}"
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield from self._render_sample(key, value)
+
+    def _render_sample(self, key, value):
+        yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = SimpleNamespace(counts=[0] * len(self.buckets), sum=0.0)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state.counts[index] += 1
+                    break
+            state.sum += value
+
+    def _render_sample(self, key, state):
+        cumulative = 0
+        for bound, count in zip(self.buckets, state.counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, (("le", _format_value(bound)),))
+            yield f"{self.name}_bucket{labels} {cumulative}"
+        labels = _format_labels(self.labelnames, key)
+        yield f"{self.name}_sum{labels} {_format_value(state.sum)}"
+        yield f"{self.name}_count{labels} {cumulative}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+REQUESTS = REGISTRY.register(Counter(
+    "http_requests_total", "HTTP requests by route, method and status code", ("route", "method", "status")
+))
+REQUEST_LATENCY = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "Time to produce the response, by route and method", ("route", "method")
+))
+IN_FLIGHT = REGISTRY.register(Gauge(
+    "http_requests_in_flight", "Requests currently being handled, by route", ("route",)
+))
+STAGE_LATENCY = REGISTRY.register(Histogram(
+    "stage_duration_seconds", "Time spent in individual processing stages", ("stage",)
+))
+STAGE_ERRORS = REGISTRY.register(Counter(
+    "stage_errors_total", "Stages that raised an exception", ("stage",)
+))
+
+
+@contextmanager
+def time_stage(stage: str):
+    """Record the duration of the enclosed block under ``stage``"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        STAGE_LATENCY.observe(time.perf_counter() - started, stage=stage)
+
+
+def timed(stage: str):
+    """Decorator form of time_stage"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with time_stage(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe_request(route: str, method: str, status: int, seconds: float):
+    REQUESTS.inc(route=route, method=method, status=str(status))
+    REQUEST_LATENCY.observe(seconds, route=route, method=method)
+
+
+def instrument_flask(app):
+    """Count, time and track in-flight requests for every Flask route, labelled by URL rule"""
+    from flask import g, request
+
+    def route_label():
+        return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started = time.perf_counter()
+        g.metrics_route = route_label()
+        IN_FLIGHT.inc(route=g.metrics_route)
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop("metrics_started", None)
+        if started is not None:
+            observe_request(g.metrics_route, request.method, response.status_code, time.perf_counter() - started)
+        return response
+
+    @app.teardown_request
+    def end_request(error=None):
+        route = g.pop("metrics_route", None)
+        if route is not None:
+            IN_FLIGHT.dec(route=route)
+
+
+class TimedGeminiClient:
+    """Wraps a Gemini client so every generation call is recorded as a stage"""
+
+    def __init__(self, client):
+        self.client = client
+        self.models = SimpleNamespace(
+            generate_content=self._generate_content,
+            generate_content_stream=self._generate_content_stream,
+        )
+        self._aio = None
+
+    @property
+    def aio(self):
+        # Resolved on first use, so wrapping a lazily loaded client does not load it
+        if self._aio is None:
+            aio_models = self.client.aio.models
+            self._aio = SimpleNamespace(models=SimpleNamespace(
+                generate_content=self._wrap_async(aio_models.generate_content),
+                generate_content_stream=self._wrap_async_stream(aio_models.generate_content_stream),
+            ))
+        return self._aio
+
+    def _generate_content(self, *args, **kwargs):
+        with time_stage("gemini.generate_content"):
+            return self.client.models.generate_content(*args, **kwargs)
+
+    def _generate_content_stream(self, *args, **kwargs):
+        # Time to first chunk and time to the end of the stream are recorded separately
+        with time_stage("gemini.stream_total"):
+            started = time.perf_counter()
+            first = True
+            for chunk in self.client.models.generate_content_stream(*args, **kwargs):
+                if first:
+                    STAGE_LATENCY.observe(time.perf_counter() - started, stage="gemini.stream_first_chunk")
+                    first = False
+                yield chunk
+
+    @staticmethod
+    def _wrap_async(fn):
+        async def wrapper(*args, **kwargs):
+            with time_stage("gemini.generate_content"):
+                return await fn(*args, **kwargs)
+        return wrapper
+
+    @staticmethod
+    def _wrap_async_stream(fn):
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            stream = await fn(*args, **kwargs)
+
+            async def chunks():
+                with time_stage("gemini.stream_total"):
+                    first = True
+                    async for chunk in stream:
+                        if first:
+                            STAGE_LATENCY.observe(time.perf_counter() - started, stage="gemini.stream_first_chunk")
+                            first = False
+                        yield chunk
+
+            return chunks()
+        return wrapper
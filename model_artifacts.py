@@ -0,0 +1,123 @@
+"""Versioned model artifacts written by train.py.
+
+Each training run creates ``<models dir>/<version>/`` holding the model files and a
+``manifest.json`` with their checksums and training/evaluation metrics. Artifact
+paths in the manifest are relative to the version directory, so a version can be
+copied or moved as a unit.
+
+    models/
+        20261016T120000Z/
+            manifest.json
+            soil_model.h5
+            fertility_model.pkl
+            fertility_model.npz
+        PINNED              optional: the version to serve instead of the newest
+"""
+import json
+import os
+import shutil
+import time
+from typing import List, Optional
+
+MANIFEST_FILE = "manifest.json"
+PIN_FILE = "PINNED"
+
+# Manifest keys of the artifacts create_app knows how to serve
+SOIL_TYPE_MODEL = "soil_type_model"
+FERTILITY_MODEL = "fertility_model"
+FERTILITY_ENGINE = "fertility_engine"
+
+
+def new_version() -> str:
+    """UTC timestamp version name; sorts in creation order"""
+    return time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+
+
+def list_versions(models_dir: str) -> List[str]:
+    """Versions in ``models_dir`` that have a manifest, sorted by name (creation order for timestamp names)"""
+    if not os.path.isdir(models_dir):
+        return []
+    return sorted(
+        name for name in os.listdir(models_dir)
+        if os.path.isfile(os.path.join(models_dir, name, MANIFEST_FILE))
+    )
+
+
+def pinned_version(models_dir: str) -> Optional[str]:
+    """Version pinned in ``models_dir`` with pin_version, or None"""
+    try:
+        with open(os.path.join(models_dir, PIN_FILE)) as file:
+            return file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def pin_version(models_dir: str, version: Optional[str]):
+    """Serve ``version`` from ``models_dir`` instead of the newest one; None removes the pin"""
+    path = os.path.join(models_dir, PIN_FILE)
+    if version is None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return
+    with open(path + ".tmp", "w") as file:
+        file.write(version + "\n")
+    os.replace(path + ".tmp", path)
+
+
+def is_models_dir(path: str) -> bool:
+    """True for a directory of versions, False for a version directory or manifest file"""
+    return os.path.isdir(path) and not os.path.isfile(os.path.join(path, MANIFEST_FILE))
+
+
+def load_manifest(path: str) -> dict:
+    """Load a version's manifest with artifact paths made absolute.
+
+    ``path`` may be a manifest file, a version directory, or a models directory, in
+    which case its pinned version or else its newest version is used.
+    """
+    if is_models_dir(path):
+        versions = list_versions(path)
+        if not versions:
+            raise FileNotFoundError(f"No model versions found in '{path}'")
+        path = os.path.join(path, pinned_version(path) or versions[-1])
+    if os.path.isdir(path):
+        path = os.path.join(path, MANIFEST_FILE)
+
+    with open(path) as file:
+        manifest = json.load(file)
+    version_dir = os.path.dirname(os.path.abspath(path))
+    manifest["directory"] = version_dir
+    for artifact in manifest.get("artifacts", {}).values():
+        artifact["path"] = os.path.join(version_dir, artifact["file"])
+    return manifest
+
+
+def artifact_path(manifest: Optional[dict], name: str) -> Optional[str]:
+    """Absolute path of artifact ``name`` in a loaded manifest, or None"""
+    if not manifest:
+        return None
+    artifact = manifest.get("artifacts", {}).get(name)
+    return artifact["path"] if artifact else None
+
+
+def write_manifest(version_dir: str, manifest: dict):
+    tmp_path = os.path.join(version_dir, MANIFEST_FILE + ".tmp")
+    with open(tmp_path, "w") as file:
+        json.dump(manifest, file, indent=2)
+    # Written last and atomically: a version only becomes visible once it is complete
+    os.replace(tmp_path, os.path.join(version_dir, MANIFEST_FILE))
+
+
+def carry_forward(previous: dict, name: str, version_dir: str) -> dict:
+    """Copy artifact ``name`` from a previous version's manifest into ``version_dir``"""
+    artifact = dict(previous["artifacts"][name])
+    source = artifact.pop("path")
+    destination = os.path.join(version_dir, artifact["file"])
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+    artifact["carried_from"] = previous.get("version")
+    return artifact
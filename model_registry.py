@@ -0,0 +1,199 @@
+"""Hot reload of the versioned models written by train.py.
+
+A ModelRegistry serves one version of a models directory (see model_artifacts.py).
+That is the pinned version if there is one, otherwise the newest. A watcher thread
+polls the directory. When the target version changes, the thread loads and warms up
+the new models while requests keep using the current ones. It then swaps the new
+version in with a single reference assignment. A request reads ``active`` once and
+runs on that version until it finishes. The old version is freed once the last such
+request is done.
+
+The pin is a file in the models directory, so every serve.py worker follows a pin
+on its next poll.
+"""
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from model_artifacts import artifact_path, list_versions, load_manifest, pin_version, pinned_version
+
+
+class LoadedVersion:
+    """The warmed-up models of one version"""
+
+    def __init__(self, manifest: dict, models: Dict[str, object], load_seconds: float):
+        self.version = manifest["version"]
+        self.manifest = manifest
+        self.models = models
+        self.load_seconds = load_seconds
+        self.activated_at = None
+
+
+class ModelRegistry:
+    """Loads, warms up and swaps versions of a models directory.
+
+    ``loaders`` maps artifact names (e.g. ``"soil_type_model"``) to functions that
+    load that model from a manifest. Each version must contain all of them.
+    ``warmups`` maps the same names to functions that run synthetic inputs through a
+    freshly loaded model before it is swapped in.
+    """
+
+    def __init__(self, models_dir: str, loaders: Dict[str, Callable[[dict], object]],
+                 warmups: Optional[Dict[str, Callable[[object], None]]] = None, poll_seconds: float = 30.0):
+        self.models_dir = models_dir
+        self.poll_seconds = poll_seconds
+        self._loaders = loaders
+        self._warmups = warmups or {}
+        # Serialises loading; requests only read _active and never wait on it
+        self._lock = threading.Lock()
+        self._active: Optional[LoadedVersion] = None
+        self._watcher = None
+        self.failed: Dict[str, str] = {}
+        self.swaps = 0
+
+    def target_version(self) -> Optional[str]:
+        """The pinned version, else the newest version that has not failed to load"""
+        versions = [version for version in list_versions(self.models_dir) if version not in self.failed]
+        return pinned_version(self.models_dir) or (versions[-1] if versions else None)
+
+    def start(self, manifest: Optional[dict] = None, preloaded: Optional[Dict[str, object]] = None):
+        """Activate the first version and start the watcher.
+
+        ``manifest`` selects the version (default: the target version). ``preloaded``
+        models are used for it instead of loading them again.
+        """
+        with self._lock:
+            if self._active is None:
+                if manifest is None:
+                    manifest = load_manifest(self.models_dir)
+                self._activate(self._load(manifest, preloaded or {}))
+        if self.poll_seconds > 0 and self._watcher is None:
+            self._watcher = threading.Thread(target=self._watch, name="model-registry", daemon=True)
+            self._watcher.start()
+        return self
+
+    @property
+    def active(self) -> LoadedVersion:
+        return self._active
+
+    def model(self, name: str):
+        return self._active.models[name]
+
+    def refresh(self) -> bool:
+        """Load and swap in the target version unless it is already active; True if it was swapped in.
+
+        A version that failed to load is not retried unless it is pinned.
+        """
+        with self._lock:
+            target = self.target_version()
+            if target is None or target in self.failed or (self._active and self._active.version == target):
+                return False
+            try:
+                loaded = self._load(load_manifest(os.path.join(self.models_dir, target)), {})
+            except Exception as e:
+                self.failed[target] = str(e)
+                print(f"Warning: model version {target} failed to load, still serving "
+                      f"{self._active.version if self._active else 'nothing'}: {e}")
+                return False
+            self._activate(loaded)
+            return True
+
+    def pin(self, version: Optional[str]) -> LoadedVersion:
+        """Serve ``version`` from now on (None follows the newest version again) and swap it in.
+
+        Raises KeyError for an unknown version and RuntimeError, leaving the previous
+        pin in place, when the version fails to load.
+        """
+        if version is not None and version not in list_versions(self.models_dir):
+            raise KeyError(version)
+        previous_pin = pinned_version(self.models_dir)
+        self.failed.pop(version, None)
+        pin_version(self.models_dir, version)
+        self.refresh()
+        if version in self.failed:
+            pin_version(self.models_dir, previous_pin)
+            raise RuntimeError(f"Model version {version} failed to load: {self.failed[version]}")
+        return self._active
+
+    def status(self) -> dict:
+        active = self._active
+        pinned = pinned_version(self.models_dir)
+        versions = []
+        for version in reversed(list_versions(self.models_dir)):
+            try:
+                manifest = load_manifest(os.path.join(self.models_dir, version))
+            except (OSError, ValueError) as e:
+                versions.append({"version": version, "error": str(e)})
+                continue
+            entry = {
+                "version": version,
+                "created_at": manifest.get("created_at"),
+                "command": manifest.get("command"),
+                "artifacts": sorted(manifest.get("artifacts", {})),
+                "active": active is not None and version == active.version,
+                "pinned": version == pinned,
+            }
+            if version in self.failed:
+                entry["error"] = self.failed[version]
+            versions.append(entry)
+        return {
+            "models_dir": os.path.abspath(self.models_dir),
+            "active": None if active is None else {
+                "version": active.version,
+                "activated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(active.activated_at)),
+                "load_seconds": active.load_seconds,
+                "models": {name: active.manifest["artifacts"][name].get("sha256") for name in active.models},
+            },
+            "pinned": pinned,
+            "poll_seconds": self.poll_seconds,
+            "swaps": self.swaps,
+            "versions": versions,
+        }
+
+    def _load(self, manifest: dict, preloaded: Dict[str, object]) -> LoadedVersion:
+        started = time.perf_counter()
+        models = {}
+        for name, loader in self._loaders.items():
+            if name in preloaded:
+                models[name] = preloaded[name]
+                continue
+            if not artifact_path(manifest, name):
+                raise FileNotFoundError(f"Model version {manifest['version']} has no {name}")
+            models[name] = loader(manifest)
+            if name in self._warmups:
+                self._warmups[name](models[name])
+        return LoadedVersion(manifest, models, round(time.perf_counter() - started, 3))
+
+    def _activate(self, loaded: LoadedVersion):
+        previous, loaded.activated_at = self._active, time.time()
+        self._active = loaded
+        if previous is None:
+            print(f"Serving model version {loaded.version} (loaded in {loaded.load_seconds}s)")
+            return
+        self.swaps += 1
+        print(f"Swapped model version {previous.version} -> {loaded.version} (loaded in {loaded.load_seconds}s)")
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_seconds)
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Warning: checking '{self.models_dir}' for new model versions failed: {e}")
+
+
+class RegistryProxy:
+    """Attribute-forwarding stand-in for one model of the active version.
+
+    The registry sits behind a LazyResource. Every attribute lookup resolves the
+    model again, so this only suits single calls. A request that makes several model
+    calls should take the models from ``registry.active`` once and use those.
+    """
+
+    def __init__(self, resource, name: str):
+        self._resource = resource
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(self._resource.get().model(self._name), attr)
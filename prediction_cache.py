@@ -0,0 +1,130 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+
+def image_cache_key(image_bytes: bytes) -> str:
+    """Content address for an uploaded image"""
+    return "type:" + hashlib.sha256(image_bytes).hexdigest()
+
+
+def nutrient_cache_key(values: Dict, fields: Iterable[str]) -> str:
+    """Content address for a nutrient vector, independent of key order and int/float spelling"""
+    canonical = json.dumps([float(values[field]) for field in fields], separators=(",", ":"))
+    return "fertility:" + hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class PredictionCache:
+    """Thread-safe LRU cache with per-entry TTL and optional SQLite persistence.
+
+    Values must be JSON serializable when ``persist_path`` is set. Hit, miss,
+    eviction and expiration counters are kept so the cache can be sized.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600, persist_path: Optional[str] = None):
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.persist_path = persist_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        if persist_path:
+            self._open_store(persist_path)
+
+    def _open_store(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS prediction_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        now = time.time()
+        self._conn.execute("DELETE FROM prediction_cache WHERE expires_at <= ?", (now,))
+        # Keep the entries that live longest, oldest first so they are evicted first
+        rows = self._conn.execute(
+            "SELECT key, value, expires_at FROM prediction_cache ORDER BY expires_at DESC LIMIT ?",
+            (self.max_entries,)
+        ).fetchall()
+        for key, value, expires_at in reversed(rows):
+            self._entries[key] = (expires_at, json.loads(value))
+        self._conn.execute(
+            "DELETE FROM prediction_cache WHERE key NOT IN (SELECT key FROM prediction_cache "
+            "ORDER BY expires_at DESC LIMIT ?)",
+            (self.max_entries,)
+        )
+        self._conn.commit()
+
+    def get(self, key: str):
+        """Return the cached value or None, refreshing its LRU position on a hit"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                self._delete(key)
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value):
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            evicted = []
+            while len(self._entries) > self.max_entries:
+                evicted_key, _ = self._entries.popitem(last=False)
+                evicted.append(evicted_key)
+                self.evictions += 1
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO prediction_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), expires_at)
+                )
+                self._conn.executemany("DELETE FROM prediction_cache WHERE key = ?", [(k,) for k in evicted])
+                self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM prediction_cache")
+                self._conn.commit()
+
+    def _delete(self, key: str):
+        if self._conn is not None:
+            self._conn.execute("DELETE FROM prediction_cache WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "persistent": self._conn is not None,
+            }
@@ -0,0 +1,267 @@
+"""Pre-forking production server for the Flask app.
+
+The parent process imports the app and loads the fertility model once, then forks
+worker processes that share those read-only pages copy-on-write. All workers
+accept connections from one listening socket created by the parent, and each
+limits its TensorFlow / TFLite / BLAS thread pools so N workers do not
+oversubscribe the cores.
+
+The soil type model is loaded in each worker after the fork, because TensorFlow's
+runtime does not survive a fork. With INFERENCE_BACKEND=tflite the interpreter
+memory-maps the .tflite file, so its weights are still shared through the page cache.
+With keras every worker would hold its own copy of TensorFlow and the model, so
+with more than one worker serve.py defaults to INFERENCE_BACKEND=tflite and refuses
+keras unless --allow-keras-per-worker is given.
+
+Each worker serves requests on a fixed pool of ``--threads`` threads. While they
+are all busy, new connections wait in the shared listen backlog, where an idle
+worker can take them.
+
+Usage:
+    python serve.py --workers 4 --bind 0.0.0.0:5000
+    python serve.py --workers 8 --threads 4 --intra-op-threads 1 --inter-op-threads 1
+
+POSIX only (uses os.fork); elsewhere run app.py or asgi.py.
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# A worker that dies this soon after starting is treated as a startup failure, not respawned
+MIN_WORKER_UPTIME = 5.0
+
+
+def parse_args():
+    cpu_count = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bind", default=os.environ.get("BIND", f"0.0.0.0:{os.environ.get('PORT', 5000)}"),
+                        help="host:port to listen on (default: BIND or 0.0.0.0:PORT)")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_WORKERS", cpu_count)),
+                        help="worker processes (default: WEB_WORKERS or the number of cores)")
+    parser.add_argument("--threads", type=int, default=int(os.environ.get("WEB_THREADS", 8)),
+                        help="request threads per worker (default: WEB_THREADS or 8)")
+    parser.add_argument("--intra-op-threads", type=int, default=None,
+                        help="threads per worker for a single op (default: cores / workers)")
+    parser.add_argument("--inter-op-threads", type=int, default=None,
+                        help="threads per worker for running independent ops concurrently (default: 1)")
+    parser.add_argument("--backlog", type=int, default=2048, help="listen backlog of the shared socket")
+    parser.add_argument("--allow-keras-per-worker", action="store_true",
+                        default=os.environ.get("ALLOW_KERAS_PER_WORKER", "").lower() in ("1", "true", "yes"),
+                        help="run the keras backend with several workers, loading TensorFlow and the model in each")
+    return parser.parse_args()
+
+
+def choose_backend(workers: int, allow_keras: bool):
+    """Pick INFERENCE_BACKEND for the workers; exits instead of loading keras once per worker.
+
+    Only the tflite backend shares the soil model's weights between workers (the
+    memory-mapped file), so it is the default when there is more than one worker.
+    """
+    backend = os.environ.get("INFERENCE_BACKEND", "").lower()
+    if workers == 1 or backend == "tflite" or allow_keras:
+        return
+    tflite_path = os.environ.get("TFLITE_MODEL_PATH",
+                                 os.path.join(os.path.dirname(os.path.abspath(__file__)), "soil_model.tflite"))
+    if not backend and os.path.exists(tflite_path):
+        os.environ["INFERENCE_BACKEND"] = "tflite"
+        print(f"Using INFERENCE_BACKEND=tflite ({tflite_path}) so the {workers} workers share the soil type model")
+        return
+    reason = "INFERENCE_BACKEND=keras" if backend else f"no TFLite model at '{tflite_path}' (create it with export_model.py)"
+    sys.exit(f"Error: {reason}: every one of the {workers} workers would load its own copy of TensorFlow "
+             f"and the soil type model. Use INFERENCE_BACKEND=tflite, --workers 1, or "
+             f"--allow-keras-per-worker to accept {workers}x the model memory.")
+
+
+def limit_threads(intra_op_threads: int, inter_op_threads: int):
+    """Size every native thread pool a worker may start; must run before numpy/TensorFlow are imported.
+
+    Variables that are already set are left alone.
+    """
+    for variable, value in (
+        ("TF_NUM_INTRAOP_THREADS", intra_op_threads),
+        ("TF_NUM_INTEROP_THREADS", inter_op_threads),
+        ("TFLITE_NUM_THREADS", intra_op_threads),
+        ("OMP_NUM_THREADS", intra_op_threads),
+        ("OPENBLAS_NUM_THREADS", intra_op_threads),
+        ("MKL_NUM_THREADS", intra_op_threads),
+    ):
+        os.environ.setdefault(variable, str(value))
+
+
+def preload_models() -> dict:
+    """Load the models that are safe to share with forked workers"""
+    from app import NUTRIENT_FIELDS, SoilQualityClassifier, fertility_model_paths, model_manifest
+
+    preloaded = {}
+    manifest = model_manifest()
+    if manifest:
+        # Lets a worker's model registry check that these belong to the version it starts with
+        preloaded["model_version"] = manifest["version"]
+    quality_model_path, forest_engine_path = fertility_model_paths(manifest)
+    if forest_engine_path or os.path.exists(quality_model_path):
+        started = time.perf_counter()
+        classifier = SoilQualityClassifier(quality_model_path, engine_path=forest_engine_path)
+        # One prediction pulls in anything imported on first use (e.g. pandas for the pickle)
+        classifier.compute_prediction({field: 1.0 for field in NUTRIENT_FIELDS})
+        preloaded["fertility_model"] = classifier
+        print(f"Preloaded fertility model in {time.perf_counter() - started:.2f}s")
+    return preloaded
+
+
+def make_bounded_server(host: str, port: int, app, threads: int, fd: int):
+    """Werkzeug WSGI server that handles requests on a fixed pool of ``threads`` threads.
+
+    A free thread is reserved before the next connection is accepted, so a worker
+    never takes on more connections than it can serve at once.
+    """
+    from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+    class RequestHandler(WSGIRequestHandler):
+        # One request per connection, so an idle keep-alive client cannot hold a thread
+        protocol_version = "HTTP/1.0"
+
+    class BoundedWSGIServer(BaseWSGIServer):
+        multithread = True
+
+        def __init__(self):
+            super().__init__(host, port, app, handler=RequestHandler, fd=fd)
+            self._slots = threading.BoundedSemaphore(threads)
+            self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="request")
+
+        def get_request(self):
+            self._slots.acquire()
+            try:
+                return super().get_request()
+            except BaseException:
+                self._slots.release()
+                raise
+
+        def process_request(self, request, client_address):
+            self._executor.submit(self._process_request, request, client_address)
+
+        def _process_request(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+        def shutdown_request(self, request):
+            # Every accepted connection ends here, whether it was served or rejected
+            try:
+                super().shutdown_request(request)
+            finally:
+                self._slots.release()
+
+    return BoundedWSGIServer()
+
+
+def run_worker(listener: socket.socket, preloaded: dict, threads: int):
+    """Body of a forked worker: build the app around the shared models and serve until signalled"""
+    from app import create_app
+
+    # The parent's handlers were inherited by the fork
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    gc.enable()
+
+    host, port = listener.getsockname()[:2]
+    app = create_app(preloaded=preloaded)
+    server = make_bounded_server(host, port, app, threads, listener.fileno())
+    print(f"Worker {os.getpid()} serving on {host}:{port} with {threads} threads")
+    server.serve_forever()
+
+
+def main():
+    args = parse_args()
+    if not hasattr(os, "fork"):
+        sys.exit("serve.py needs os.fork; run app.py or asgi.py on this platform")
+
+    workers = max(1, args.workers)
+    choose_backend(workers, args.allow_keras_per_worker)
+    intra_op_threads = args.intra_op_threads or max(1, (os.cpu_count() or 1) // workers)
+    inter_op_threads = args.inter_op_threads or 1
+    limit_threads(intra_op_threads, inter_op_threads)
+
+    host, _, port = args.bind.rpartition(":")
+    listener = socket.create_server((host or "0.0.0.0", int(port)), backlog=args.backlog)
+
+    # Keep the collector from touching (and so copying) the preloaded objects in every worker
+    gc.disable()
+    preloaded = preload_models()
+    gc.collect()
+    gc.freeze()
+
+    children = {}
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(listener, preloaded, max(1, args.threads))
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else 0
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = time.monotonic()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    print(f"Starting {workers} workers on {args.bind} "
+          f"({intra_op_threads} intra-op / {inter_op_threads} inter-op threads each)")
+    if workers > 1 and os.environ.get("INFERENCE_BACKEND", "keras").lower() != "tflite":
+        print(f"Warning: --allow-keras-per-worker: each of the {workers} workers loads its own copy of "
+              f"TensorFlow and the soil type model")
+    for _ in range(workers):
+        spawn()
+
+    exit_code = 0
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        started = children.pop(pid, None)
+        if started is None or stopping:
+            continue
+
+        code = os.waitstatus_to_exitcode(status)
+        if time.monotonic() - started < MIN_WORKER_UPTIME:
+            print(f"Error: worker {pid} exited with {code} during startup, shutting down")
+            exit_code = 1
+            stop(signal.SIGTERM, None)
+        else:
+            print(f"Warning: worker {pid} exited with {code}, starting a replacement")
+            spawn()
+
+    listener.close()
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
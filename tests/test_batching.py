@@ -0,0 +1,75 @@
+import threading
+
+import numpy as np
+import pytest
+
+from batching import BatchPredictor
+
+
+def test_each_caller_gets_its_own_rows_back():
+    batch_sizes = []
+
+    def predict(inputs):
+        batch_sizes.append(len(inputs))
+        return inputs * 10
+
+    predictor = BatchPredictor(predict, max_batch_size=8, max_wait_ms=20)
+    results = {}
+
+    def call(number):
+        rows = 1 + number % 3
+        tensor = np.full((rows, 2), number, dtype=np.float32)
+        results[number] = (tensor, predictor.predict(tensor, timeout=10))
+
+    threads = [threading.Thread(target=call, args=(number,)) for number in range(24)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    predictor.close()
+
+    assert len(results) == 24
+    for tensor, output in results.values():
+        np.testing.assert_array_equal(output, tensor * 10)
+    assert max(batch_sizes) <= 8
+    assert sum(batch_sizes) == sum(len(tensor) for tensor, _ in results.values())
+
+
+def test_inputs_for_different_contexts_are_not_batched_together():
+    seen = []
+
+    def predict(inputs, context):
+        seen.append((context, inputs[:, 0].tolist()))
+        return inputs + context
+
+    predictor = BatchPredictor(predict, max_batch_size=16, max_wait_ms=50)
+    contexts = [100, 200]
+    results = {}
+
+    def call(number):
+        context = contexts[number % 2]
+        results[number] = predictor.predict(np.array([[number]], dtype=np.float32), timeout=10, context=context)
+
+    threads = [threading.Thread(target=call, args=(number,)) for number in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    predictor.close()
+
+    for number, output in results.items():
+        assert output.tolist() == [[number + contexts[number % 2]]]
+    for context, values in seen:
+        assert all(contexts[int(value) % 2] == context for value in values)
+
+
+def test_predict_errors_reach_every_caller_in_the_batch():
+    def predict(inputs):
+        raise RuntimeError("model failed")
+
+    predictor = BatchPredictor(predict, max_batch_size=4, max_wait_ms=1)
+    with pytest.raises(RuntimeError, match="model failed"):
+        predictor.predict(np.zeros((1, 2)), timeout=10)
+    predictor.close()
+    with pytest.raises(RuntimeError, match="closed"):
+        predictor.predict(np.zeros((1, 2)))
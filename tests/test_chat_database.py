@@ -0,0 +1,83 @@
+import sqlite3
+
+import pytest
+
+from chat_database import MIGRATIONS, ChatDatabase
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = ChatDatabase(str(tmp_path / "chat.db"), pool_size=2)
+    yield database
+    database.close()
+
+
+def test_history_pages_walk_back_without_gaps(db):
+    db.create_session("a")
+    db.create_session("b")
+    for number in range(7):
+        db.add_message("a", "user", f"a{number}")
+        db.add_message("b", "user", f"b{number}")
+
+    page = db.get_session_history_page("a", limit=3)
+    assert [m["content"] for m in page["messages"]] == ["a4", "a5", "a6"]
+
+    page = db.get_session_history_page("a", limit=3, before_id=page["next_cursor"])
+    assert [m["content"] for m in page["messages"]] == ["a1", "a2", "a3"]
+
+    page = db.get_session_history_page("a", limit=3, before_id=page["next_cursor"])
+    assert [m["content"] for m in page["messages"]] == ["a0"]
+    assert page["next_cursor"] is None
+
+
+def test_history_page_cursor_is_none_when_page_is_exactly_full(db):
+    db.create_session("a")
+    for number in range(3):
+        db.add_message("a", "user", str(number))
+
+    page = db.get_session_history_page("a", limit=3)
+    assert len(page["messages"]) == 3
+    assert page["next_cursor"] is None
+    assert db.get_session_history_page("missing", limit=3) == {"messages": [], "next_cursor": None}
+
+
+def test_migrates_database_from_user_version_zero(tmp_path):
+    path = str(tmp_path / "old.db")
+    # The schema as it existed before migrations were introduced
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE sessions (
+            session_id TEXT PRIMARY KEY,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        INSERT INTO sessions (session_id) VALUES ('old');
+        INSERT INTO messages (session_id, role, content) VALUES ('old', 'user', 'hello');
+    """)
+    conn.close()
+
+    db = ChatDatabase(path)
+    try:
+        assert db._query("PRAGMA user_version")[0][0] == len(MIGRATIONS)
+        indexes = {row[0] for row in db._query("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        assert {"idx_messages_session_id", "idx_sessions_last_activity"} <= indexes
+
+        assert [m["content"] for m in db.get_session_history("old")] == ["hello"]
+        assert db.save_summary("old", "greeting", 1)
+        assert db.get_summary("old")["summary"] == "greeting"
+    finally:
+        db.close()
+
+    # Reopening an up-to-date database applies nothing twice
+    db = ChatDatabase(path)
+    try:
+        assert db._query("PRAGMA user_version")[0][0] == len(MIGRATIONS)
+    finally:
+        db.close()
@@ -0,0 +1,62 @@
+import io
+
+from werkzeug.datastructures import FileStorage
+
+from fertility_bulk import detect_format, iter_chunks, iter_records, open_upload_stream
+
+
+def lines(text):
+    return io.BytesIO(text.encode("utf-8"))
+
+
+def test_csv_rows_are_numbered_and_blank_cells_dropped():
+    body = "\ufeffN , P,K\n245, 8.1,560\n1,,3\n"
+    assert list(iter_records(lines(body), "csv")) == [
+        (1, {"N": "245", "P": "8.1", "K": "560"}, None),
+        (2, {"N": "1", "K": "3"}, None),
+    ]
+
+
+def test_ndjson_reports_bad_lines_as_error_rows():
+    body = '{"N": 245}\n\nnot json\n[1, 2]\n{"N": 1}\n'
+    records = list(iter_records(lines(body), "ndjson"))
+
+    assert records[0] == (1, {"N": 245}, None)
+    assert records[1][0] == 2 and records[1][1] is None
+    assert records[1][2].startswith("Invalid JSON")
+    assert records[2] == (3, None, "Each NDJSON line must be a JSON object")
+    assert records[3] == (4, {"N": 1}, None)
+
+
+def test_multipart_upload_stays_readable_after_close():
+    upload = FileStorage(stream=io.BytesIO(b"N,P\n1,2\n"), filename="rows.csv", content_type="text/csv")
+    stream = open_upload_stream(upload)
+    upload.close()
+    try:
+        fmt = detect_format(upload.filename, upload.content_type)
+        assert list(iter_records(stream, fmt)) == [(1, {"N": "1", "P": "2"}, None)]
+    finally:
+        stream.close()
+
+
+def test_spooled_multipart_upload_is_read_from_a_duplicated_descriptor(tmp_path):
+    with open(tmp_path / "rows.ndjson", "w+b") as spooled:
+        spooled.write(b'{"N": 1}\n')
+        spooled.seek(0)
+        stream = open_upload_stream(FileStorage(stream=spooled, filename="rows.ndjson"))
+    try:
+        assert list(iter_records(stream, "ndjson")) == [(1, {"N": 1}, None)]
+    finally:
+        stream.close()
+
+
+def test_detect_format():
+    assert detect_format("rows.jsonl") == "ndjson"
+    assert detect_format("rows.csv", "application/x-ndjson") == "csv"
+    assert detect_format(content_type="application/x-ndjson") == "ndjson"
+    assert detect_format("rows.csv", requested="NDJSON") == "ndjson"
+    assert detect_format() == "csv"
+
+
+def test_iter_chunks():
+    assert list(iter_chunks(range(5), 2)) == [[0, 1], [2, 3], [4]]
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from forest_engine import ForestEngine
+
+ensemble = pytest.importorskip("sklearn.ensemble")
+
+
+@pytest.fixture(scope="module")
+def forest():
+    rng = np.random.default_rng(0)
+    X = rng.uniform(-3.0, 10.0, size=(600, 12))
+    y = np.where(X[:, 0] + X[:, 3] * X[:, 5] > 4.0, "Fertile", "Less Fertile")
+    y[X[:, 7] > 8.5] = "Highly Fertile"
+    return ensemble.RandomForestClassifier(n_estimators=25, max_depth=8, random_state=0).fit(X, y)
+
+
+def test_predictions_match_sklearn(forest):
+    engine = ForestEngine.from_sklearn(forest)
+    X = np.random.default_rng(1).uniform(-3.0, 10.0, size=(2000, 12))
+    np.testing.assert_array_equal(engine.predict(X), forest.predict(X))
+    np.testing.assert_allclose(engine.predict_proba(X), forest.predict_proba(X))
+
+
+def test_save_and_load_round_trip(forest, tmp_path):
+    path = str(tmp_path / "forest.npz")
+    engine = ForestEngine.from_sklearn(forest)
+    engine.source_sha256 = "abc"
+    engine.save(path)
+
+    loaded = ForestEngine.load(path)
+    X = np.random.default_rng(2).uniform(-3.0, 10.0, size=(200, 12))
+    np.testing.assert_array_equal(loaded.predict(X), forest.predict(X))
+    assert loaded.source_sha256 == "abc"
+
+
+@pytest.mark.parametrize("value", [np.nan, np.inf, -np.inf, 1e300])
+def test_non_finite_rows_raise_like_sklearn(forest, value):
+    engine = ForestEngine.from_sklearn(forest)
+    X = np.zeros((3, 12))
+    X[1, 4] = value
+
+    with pytest.raises(ValueError) as expected:
+        forest.predict(X)
+    with pytest.raises(ValueError) as actual:
+        engine.predict(X)
+    assert str(actual.value) == str(expected.value).splitlines()[0]
+
+
+def test_rejects_wrong_feature_count(forest):
+    with pytest.raises(ValueError):
+        ForestEngine.from_sklearn(forest).predict(np.zeros((1, 11)))
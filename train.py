@@ -0,0 +1,282 @@
+"""Headless training and evaluation of both models, written as a versioned artifact set.
+
+Each run creates ``<models dir>/<version>/`` (see model_artifacts.py) with the
+trained models and a manifest.json that records the checksums, hyperparameters,
+per-epoch wall-clock time, images/sec and evaluation metrics. A model that is not
+retrained in a run is copied over from the previous version, so every version is
+complete. Serve a version with MODEL_MANIFEST=models (newest) or
+MODEL_MANIFEST=models/<version>.
+
+Usage:
+    python train.py soil [--images "Soil types"] [--epochs 20]
+    python train.py fertility --data fertility.csv [--target Output]
+    python train.py all --data fertility.csv
+"""
+import argparse
+import json
+import os
+import pickle
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from app import CLASS_NAMES, SoilQualityClassifier
+from forest_engine import ForestEngine, file_sha256
+from model_artifacts import (
+    FERTILITY_ENGINE,
+    FERTILITY_MODEL,
+    SOIL_TYPE_MODEL,
+    carry_forward,
+    list_versions,
+    load_manifest,
+    new_version,
+    pinned_version,
+    write_manifest,
+)
+from training import load_manifest as load_shard_manifest
+from training import make_dataset, train_soil_model, write_shards
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def evaluation_metrics(labels: np.ndarray, predictions: np.ndarray, class_names) -> dict:
+    confusion = np.zeros((len(class_names), len(class_names)), dtype=int)
+    np.add.at(confusion, (labels, predictions), 1)
+    per_class = {}
+    for index, name in enumerate(class_names):
+        support = int(confusion[index].sum())
+        predicted = int(confusion[:, index].sum())
+        precision = confusion[index, index] / predicted if predicted else 0.0
+        recall = confusion[index, index] / support if support else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        per_class[name] = {"precision": round(float(precision), 4), "recall": round(float(recall), 4),
+                           "f1": round(float(f1), 4), "support": support}
+    return {
+        "accuracy": round(float(np.mean(labels == predictions)), 4) if len(labels) else None,
+        "macro_f1": round(float(np.mean([scores["f1"] for scores in per_class.values()])), 4),
+        "per_class": per_class,
+        "confusion_matrix": confusion.tolist(),
+    }
+
+
+def train_soil(args, version_dir: str) -> dict:
+    """Shard the images if needed, fit the soil type model, evaluate it on the validation split"""
+    import tf_keras
+
+    if args.rebuild_shards or not os.path.exists(os.path.join(args.shards, "manifest.json")):
+        print(f"Writing shards of '{args.images}' to '{args.shards}'")
+        write_shards(args.images, args.shards, seed=args.seed)
+    shards = load_shard_manifest(args.shards)
+    train_images = shards["splits"]["train"]["images"]
+
+    class EpochTimer(tf_keras.callbacks.Callback):
+        def __init__(self):
+            super().__init__()
+            self.epochs = []
+
+        def on_epoch_begin(self, epoch, logs=None):
+            self._started = time.perf_counter()
+
+        def on_epoch_end(self, epoch, logs=None):
+            seconds = time.perf_counter() - self._started
+            self.epochs.append({
+                "epoch": epoch + 1,
+                "seconds": round(seconds, 3),
+                "images_per_second": round(train_images / seconds, 1),
+                **{key: round(float(value), 4) for key, value in (logs or {}).items()},
+            })
+            print(json.dumps(self.epochs[-1]))
+
+    timer = EpochTimer()
+    tf_keras.utils.set_random_seed(args.seed)
+    started = time.perf_counter()
+    model, _ = train_soil_model(args.shards, args.epochs, args.batch_size, callbacks=[timer], seed=args.seed)
+    train_seconds = time.perf_counter() - started
+
+    labels, predictions = [], []
+    started = time.perf_counter()
+    for images, batch_labels in make_dataset(args.shards, "val", args.batch_size, cache=False):
+        predictions.append(np.argmax(model.predict_on_batch(images), axis=1))
+        labels.append(batch_labels.numpy())
+    eval_seconds = time.perf_counter() - started
+    labels, predictions = np.concatenate(labels), np.concatenate(predictions)
+
+    path = os.path.join(version_dir, "soil_model.h5")
+    model.save(path)
+    metrics = evaluation_metrics(labels, predictions, CLASS_NAMES)
+    metrics["eval_images_per_second"] = round(len(labels) / eval_seconds, 1)
+    return {
+        "file": os.path.basename(path),
+        "sha256": file_sha256(path),
+        "bytes": os.path.getsize(path),
+        "data": {"images": args.images, "train_images": train_images,
+                 "val_images": shards["splits"]["val"]["images"]},
+        "hyperparameters": {"epochs": args.epochs, "batch_size": args.batch_size, "seed": args.seed},
+        "train_seconds": round(train_seconds, 3),
+        "epochs": timer.epochs,
+        "validation": metrics,
+    }
+
+
+def train_fertility(args, version_dir: str) -> dict:
+    """Fit the random forest on a nutrient CSV, evaluate it on a held-out split, flatten it for serving"""
+    import pandas as pd
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.model_selection import train_test_split
+
+    frame = pd.read_csv(args.data)
+    # Column names are matched case-insensitively (datasets use "pH", "EC", "Zn", ...)
+    columns = {column.lower(): column for column in frame.columns}
+    features = SoilQualityClassifier.expected_features
+    missing = [field for field in features if field.lower() not in columns]
+    if args.target not in frame.columns:
+        missing.append(args.target)
+    if missing:
+        sys.exit(f"'{args.data}' is missing columns: {', '.join(missing)}")
+    frame = frame.dropna(subset=[columns[field.lower()] for field in features] + [args.target])
+
+    X = SoilQualityClassifier.log_transform(
+        frame[[columns[field.lower()] for field in features]].to_numpy(dtype=np.float64)
+    )
+    y = frame[args.target].to_numpy(dtype=int)
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=args.test_size, random_state=args.seed, stratify=y
+    )
+
+    # Fitted on a DataFrame so the model keeps its feature names, like the original pickle
+    forest = RandomForestClassifier(n_estimators=args.n_estimators, max_depth=args.max_depth,
+                                    max_features="sqrt", random_state=args.seed, n_jobs=-1)
+    started = time.perf_counter()
+    forest.fit(pd.DataFrame(X_train, columns=features), y_train)
+    train_seconds = time.perf_counter() - started
+    # Serving scores small batches, where joblib's per-call overhead outweighs parallel trees
+    forest.n_jobs = None
+
+    pickle_path = os.path.join(version_dir, "fertility_model.pkl")
+    with open(pickle_path, "wb") as file:
+        pickle.dump(forest, file)
+    engine = ForestEngine.from_sklearn(forest)
+    engine.source_sha256 = file_sha256(pickle_path)
+    engine_path = os.path.join(version_dir, "fertility_model.npz")
+    engine.save(engine_path)
+
+    started = time.perf_counter()
+    predictions = engine.predict(X_test)
+    eval_seconds = time.perf_counter() - started
+    mismatches = int(np.sum(predictions != forest.predict(pd.DataFrame(X_test, columns=features))))
+    metrics = evaluation_metrics(y_test, predictions, SoilQualityClassifier.categories)
+    metrics["eval_rows_per_second"] = round(len(y_test) / eval_seconds, 1) if eval_seconds else None
+    metrics["engine_mismatches"] = mismatches
+
+    return {
+        FERTILITY_MODEL: {
+            "file": os.path.basename(pickle_path),
+            "sha256": file_sha256(pickle_path),
+            "bytes": os.path.getsize(pickle_path),
+            "data": {"path": args.data, "target": args.target, "rows": int(len(frame)),
+                     "train_rows": int(len(y_train)), "test_rows": int(len(y_test))},
+            "hyperparameters": {"n_estimators": args.n_estimators, "max_depth": args.max_depth,
+                                "test_size": args.test_size, "seed": args.seed},
+            "train_seconds": round(train_seconds, 3),
+            "rows_per_second": round(len(y_train) / train_seconds, 1),
+            "test": metrics,
+        },
+        FERTILITY_ENGINE: {
+            "file": os.path.basename(engine_path),
+            "sha256": file_sha256(engine_path),
+            "bytes": os.path.getsize(engine_path),
+            "source_sha256": engine.source_sha256,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=["soil", "fertility", "all"])
+    parser.add_argument("--models-dir", default=os.environ.get("MODELS_DIR", os.path.join(BASE_DIR, "models")))
+    parser.add_argument("--version", default=None, help="version name (default: UTC timestamp)")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="random seed (default: 35 for the soil model, 42 for the forest, as in the notebook)")
+
+    soil = parser.add_argument_group("soil type model")
+    soil.add_argument("--images", default=os.path.join(BASE_DIR, "Soil types"))
+    soil.add_argument("--shards", default=os.path.join(BASE_DIR, "data", "shards"))
+    soil.add_argument("--rebuild-shards", action="store_true", help="re-shard even if --shards already exists")
+    soil.add_argument("--epochs", type=int, default=20)
+    soil.add_argument("--batch-size", type=int, default=16)
+    soil.add_argument("--min-val-accuracy", type=float, default=0.0,
+                      help="do not publish the version when validation accuracy is below this")
+
+    fertility = parser.add_argument_group("fertility model")
+    fertility.add_argument("--data", help="CSV with the 12 nutrient columns and a class column")
+    fertility.add_argument("--target", default="Output", help="class column: 0 Less Fertile, 1 Fertile, 2 Highly Fertile")
+    fertility.add_argument("--test-size", type=float, default=0.2)
+    fertility.add_argument("--n-estimators", type=int, default=200)
+    fertility.add_argument("--max-depth", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command in ("fertility", "all") and not args.data:
+        parser.error("--data is required to train the fertility model")
+
+    version = args.version or new_version()
+    version_dir = os.path.join(args.models_dir, version)
+    os.makedirs(version_dir, exist_ok=False)
+    previous_versions = list_versions(args.models_dir)
+    previous = load_manifest(os.path.join(args.models_dir, previous_versions[-1])) if previous_versions else None
+
+    started = time.perf_counter()
+    artifacts = {}
+    if args.command in ("soil", "all"):
+        soil_args = argparse.Namespace(**vars(args))
+        soil_args.seed = 35 if args.seed is None else args.seed
+        artifacts[SOIL_TYPE_MODEL] = train_soil(soil_args, version_dir)
+    if args.command in ("fertility", "all"):
+        fertility_args = argparse.Namespace(**vars(args))
+        fertility_args.seed = 42 if args.seed is None else args.seed
+        artifacts.update(train_fertility(fertility_args, version_dir))
+
+    if previous:
+        for name in previous.get("artifacts", {}):
+            if name not in artifacts:
+                artifacts[name] = carry_forward(previous, name, version_dir)
+
+    manifest = {
+        "version": version,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "command": args.command,
+        "git_commit": git_commit(),
+        "environment": {"python": platform.python_version(), "numpy": np.__version__, "cpu_count": os.cpu_count()},
+        "wall_seconds": round(time.perf_counter() - started, 3),
+        "artifacts": artifacts,
+    }
+
+    soil_accuracy = artifacts.get(SOIL_TYPE_MODEL, {}).get("validation", {}).get("accuracy")
+    if SOIL_TYPE_MODEL in artifacts and "carried_from" not in artifacts[SOIL_TYPE_MODEL] \
+            and soil_accuracy is not None and soil_accuracy < args.min_val_accuracy:
+        # Without a manifest the directory is not a version that create_app will load
+        with open(os.path.join(version_dir, "rejected.json"), "w") as file:
+            json.dump(manifest, file, indent=2)
+        sys.exit(f"Validation accuracy {soil_accuracy} is below --min-val-accuracy {args.min_val_accuracy}; "
+                 f"version {version} not published")
+
+    write_manifest(version_dir, manifest)
+    print(json.dumps({"version": version, "directory": version_dir,
+                      "artifacts": {name: artifact["file"] for name, artifact in artifacts.items()}}, indent=2))
+    if pinned_version(args.models_dir):
+        print(f"Warning: '{args.models_dir}' is pinned to version {pinned_version(args.models_dir)}; "
+              f"{version} is not served until the pin is removed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+"""Sharded training data and a streaming tf.data pipeline for the soil type model.
+
+``shards`` converts the ``Soil types/<class name>/`` tree into TFRecord shards.
+Each image is resized exactly as the server does (see app.load_resized_image) and
+stored as a lossless 224x224 PNG, along with its label and source path. The images
+are split into stratified train and validation sets like the notebook's
+train_test_split. ``fit`` trains the notebook's architecture from those shards
+through tf.data, with parallel reads and decodes, caching and prefetching, so
+memory use does not grow with the size of the dataset.
+
+Usage:
+    python training.py shards --images "Soil types" --output data/shards
+    python training.py fit --shards data/shards --epochs 20 --output my_model.h5
+    python training.py bench --shards data/shards
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple, Union
+
+from app import CLASS_NAMES, IMAGE_SIZE, load_resized_image
+from image_batch import IMAGE_EXTENSIONS
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MANIFEST_FILE = "manifest.json"
+# cache="auto" keeps decoded images in memory only while they fit in this many bytes
+MEMORY_CACHE_LIMIT = 2 * 1024 ** 3
+HUB_FEATURE_VECTOR = "https://tfhub.dev/google/tf2-preview/mobilenet_v2/feature_vector/4"
+
+
+def list_labelled_images(images_dir: str) -> List[Tuple[str, int]]:
+    """Return (path, class index) for every image under ``images_dir/<class name>/``"""
+    images = []
+    for index, class_name in enumerate(CLASS_NAMES):
+        for path in sorted(glob.glob(os.path.join(images_dir, class_name, "*"))):
+            if path.lower().endswith(IMAGE_EXTENSIONS):
+                images.append((path, index))
+    return images
+
+
+def split_images(images: List[Tuple[str, int]], val_fraction: float = 0.2,
+                 seed: int = 35) -> Dict[str, List[Tuple[str, int]]]:
+    """Shuffle and split per class, so both splits keep the class proportions"""
+    rng = random.Random(seed)
+    splits = {"train": [], "val": []}
+    for index in range(len(CLASS_NAMES)):
+        members = [image for image in images if image[1] == index]
+        rng.shuffle(members)
+        val_count = int(round(len(members) * val_fraction))
+        splits["val"].extend(members[:val_count])
+        splits["train"].extend(members[val_count:])
+    for members in splits.values():
+        rng.shuffle(members)
+    return splits
+
+
+def encode_image(path: str) -> bytes:
+    """Read an image and return it as a 224x224 RGB PNG"""
+    with open(path, "rb") as file:
+        image = load_resized_image(file.read())
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def write_shards(images_dir: str, output_dir: str, images_per_shard: int = 1024, val_fraction: float = 0.2,
+                 seed: int = 35, workers: Optional[int] = None) -> dict:
+    """Write ``<split>-NNNNN-of-NNNNN.tfrecord`` shards and a manifest describing them.
+
+    Images are decoded on a thread pool a window at a time, so only a few hundred
+    are held in memory however large the dataset is.
+    """
+    import tensorflow as tf
+
+    images = list_labelled_images(images_dir)
+    if not images:
+        raise ValueError(f"No images found under '{images_dir}/<class name>/'")
+    os.makedirs(output_dir, exist_ok=True)
+
+    started = time.perf_counter()
+    manifest = {
+        "class_names": CLASS_NAMES,
+        "image_size": list(IMAGE_SIZE),
+        "source": os.path.abspath(images_dir),
+        "seed": seed,
+        "splits": {},
+        "failed": [],
+    }
+    window = 256
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 4) as executor:
+        for split, members in split_images(images, val_fraction, seed).items():
+            shard_count = max(1, -(-len(members) // images_per_shard))
+            shards = [f"{split}-{shard:05d}-of-{shard_count:05d}.tfrecord" for shard in range(shard_count)]
+            written = [0] * shard_count
+            class_counts = [0] * len(CLASS_NAMES)
+
+            def encode(member):
+                try:
+                    return encode_image(member[0]), None
+                except Exception as e:
+                    return None, str(e)
+
+            writers = [tf.io.TFRecordWriter(os.path.join(output_dir, name)) for name in shards]
+            try:
+                for start in range(0, len(members), window):
+                    chunk = members[start:start + window]
+                    for offset, ((path, label), (png, error)) in enumerate(zip(chunk, executor.map(encode, chunk))):
+                        if error is not None:
+                            manifest["failed"].append({"path": path, "error": error})
+                            continue
+                        example = tf.train.Example(features=tf.train.Features(feature={
+                            "image": tf.train.Feature(bytes_list=tf.train.BytesList(value=[png])),
+                            "label": tf.train.Feature(int64_list=tf.train.Int64List(value=[label])),
+                            "path": tf.train.Feature(bytes_list=tf.train.BytesList(
+                                value=[os.path.relpath(path, images_dir).encode("utf-8")])),
+                        }))
+                        # Round-robin, so every shard holds a mix of classes
+                        shard = (start + offset) % shard_count
+                        writers[shard].write(example.SerializeToString())
+                        written[shard] += 1
+                        class_counts[label] += 1
+            finally:
+                for writer in writers:
+                    writer.close()
+
+            manifest["splits"][split] = {
+                "shards": shards,
+                "images": sum(written),
+                "class_counts": dict(zip(CLASS_NAMES, class_counts)),
+            }
+
+    manifest["seconds"] = round(time.perf_counter() - started, 3)
+    with open(os.path.join(output_dir, MANIFEST_FILE), "w") as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+
+def load_manifest(shard_dir: str) -> dict:
+    with open(os.path.join(shard_dir, MANIFEST_FILE)) as file:
+        return json.load(file)
+
+
+def make_dataset(shard_dir: str, split: str, batch_size: int = 32, training: bool = False,
+                 cache: Union[bool, str] = "auto", shuffle_buffer: int = 2048, seed: Optional[int] = None):
+    """Build a batched tf.data pipeline of (float32 images in [0, 1], int labels) for one split.
+
+    Shards are read and decoded in parallel. ``cache`` keeps the decoded uint8 images
+    in memory (True), in files with this path prefix (a string) or not at all (False),
+    so later epochs skip the PNG decode; "auto" caches in memory while the split fits
+    in MEMORY_CACHE_LIMIT. Training pipelines shuffle the shards and examples and add
+    random flips after the cache.
+    """
+    import tensorflow as tf
+
+    autotune = tf.data.AUTOTUNE
+    manifest = load_manifest(shard_dir)
+    files = [os.path.join(shard_dir, name) for name in manifest["splits"][split]["shards"]]
+    height, width = manifest["image_size"][1], manifest["image_size"][0]
+    if cache == "auto":
+        cache = manifest["splits"][split]["images"] * height * width * 3 <= MEMORY_CACHE_LIMIT
+    feature_spec = {
+        "image": tf.io.FixedLenFeature([], tf.string),
+        "label": tf.io.FixedLenFeature([], tf.int64),
+    }
+
+    def decode(record):
+        example = tf.io.parse_single_example(record, feature_spec)
+        image = tf.io.decode_png(example["image"], channels=3)
+        image.set_shape([height, width, 3])
+        return image, tf.cast(example["label"], tf.int32)
+
+    dataset = tf.data.Dataset.from_tensor_slices(files)
+    if training:
+        dataset = dataset.shuffle(len(files), seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.interleave(
+        tf.data.TFRecordDataset,
+        cycle_length=min(len(files), os.cpu_count() or 4),
+        num_parallel_calls=autotune,
+        deterministic=not training,
+    )
+    dataset = dataset.map(decode, num_parallel_calls=autotune, deterministic=not training)
+    if cache:
+        dataset = dataset.cache(f"{cache}.{split}" if isinstance(cache, str) else "")
+
+    if training:
+        dataset = dataset.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+
+    def to_model_input(images, labels):
+        images = tf.cast(images, tf.float32) / 255.0
+        if training:
+            images = tf.image.random_flip_left_right(images)
+            images = tf.image.random_flip_up_down(images)
+        return images, labels
+
+    # Batch before scaling and flipping, so those run once per batch
+    return dataset.batch(batch_size).map(to_model_input, num_parallel_calls=autotune).prefetch(autotune)
+
+
+def build_soil_model(hub_url: str = HUB_FEATURE_VECTOR, learning_rate: float = 1e-3):
+    """The notebook's architecture: frozen MobileNetV2 features and a dense softmax head"""
+    # CRITICAL: Import tf_keras before tensorflow to ensure Keras 2.x compatibility
+    import tf_keras
+    import tensorflow_hub as hub
+
+    model = tf_keras.Sequential([
+        hub.KerasLayer(hub_url, input_shape=(IMAGE_SIZE[1], IMAGE_SIZE[0], 3), trainable=False),
+        tf_keras.layers.Flatten(),
+        tf_keras.layers.Dense(1024, activation="relu"),
+        tf_keras.layers.Dense(512, activation="relu"),
+        tf_keras.layers.Dense(256, activation="relu"),
+        tf_keras.layers.Dense(len(CLASS_NAMES), activation="softmax"),
+    ])
+    model.compile(
+        optimizer=tf_keras.optimizers.Adam(learning_rate),
+        # The last layer already applies softmax
+        loss=tf_keras.losses.SparseCategoricalCrossentropy(),
+        metrics=["acc"],
+    )
+    return model
+
+
+def train_soil_model(shard_dir: str, epochs: int = 20, batch_size: int = 16, cache: Union[bool, str] = "auto",
+                     seed: int = 35, callbacks=None):
+    """Fit a fresh soil type model on the train shards; returns (model, keras History)"""
+    train = make_dataset(shard_dir, "train", batch_size, training=True, cache=cache, seed=seed)
+    val = make_dataset(shard_dir, "val", batch_size, cache=cache)
+    model = build_soil_model()
+    history = model.fit(train, validation_data=val, epochs=epochs, callbacks=callbacks, verbose=2)
+    return model, history
+
+
+def bench(args):
+    """Images per second the input pipeline alone can deliver"""
+    dataset = make_dataset(args.shards, args.split, args.batch_size, training=True, cache=False)
+    for epoch in range(args.epochs):
+        started = time.perf_counter()
+        images = 0
+        for batch, _ in dataset:
+            images += int(batch.shape[0])
+        seconds = time.perf_counter() - started
+        print(json.dumps({"epoch": epoch + 1, "images": images,
+                          "images_per_second": round(images / seconds, 1) if seconds else None}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    shards_parser = subparsers.add_parser("shards", help="convert an image tree into TFRecord shards")
+    shards_parser.add_argument("--images", default=os.path.join(BASE_DIR, "Soil types"))
+    shards_parser.add_argument("--output", default=os.path.join(BASE_DIR, "data", "shards"))
+    shards_parser.add_argument("--images-per-shard", type=int, default=1024)
+    shards_parser.add_argument("--val-fraction", type=float, default=0.2)
+    shards_parser.add_argument("--seed", type=int, default=35)
+
+    fit_parser = subparsers.add_parser("fit", help="train the soil type model from shards")
+    fit_parser.add_argument("--shards", default=os.path.join(BASE_DIR, "data", "shards"))
+    fit_parser.add_argument("--epochs", type=int, default=20)
+    fit_parser.add_argument("--batch-size", type=int, default=16)
+    fit_parser.add_argument("--cache", default="auto",
+                            help="'auto', 'memory', 'none', or a file prefix for an on-disk cache of decoded images")
+    fit_parser.add_argument("--output", default=os.path.join(BASE_DIR, "my_model.h5"))
+
+    bench_parser = subparsers.add_parser("bench", help="measure input pipeline throughput")
+    bench_parser.add_argument("--shards", default=os.path.join(BASE_DIR, "data", "shards"))
+    bench_parser.add_argument("--split", default="train")
+    bench_parser.add_argument("--batch-size", type=int, default=32)
+    bench_parser.add_argument("--epochs", type=int, default=2)
+
+    args = parser.parse_args()
+    if args.command == "shards":
+        manifest = write_shards(args.images, args.output, args.images_per_shard, args.val_fraction, args.seed)
+        print(json.dumps({split: info["images"] for split, info in manifest["splits"].items()}
+                         | {"failed": len(manifest["failed"]), "seconds": manifest["seconds"]}, indent=2))
+    elif args.command == "fit":
+        cache = {"memory": True, "none": False}.get(args.cache, args.cache)
+        model, history = train_soil_model(args.shards, args.epochs, args.batch_size, cache)
+        model.save(args.output)
+        print(json.dumps({key: [round(float(value), 4) for value in values]
+                          for key, values in history.history.items()}, indent=2))
+    else:
+        bench(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+
+class JobQueueFull(Exception):
+    """Raised by VerificationJobs.submit when no more jobs can be accepted right now"""
+
+
+class VerificationJobs:
+    """Runs slow verification calls on a background executor and tracks their results by job ID.
+
+    Finished jobs are kept for ``ttl_seconds`` (and at most ``max_jobs``) so clients
+    have time to poll for them. Only finished jobs are ever evicted. At most
+    ``max_pending`` jobs may be queued or running; beyond that, or when every slot
+    holds an unfinished job, ``submit`` raises JobQueueFull instead of dropping work.
+    """
+
+    def __init__(self, max_workers: int = 4, max_jobs: int = 10000, ttl_seconds: float = 900,
+                 max_pending: int = 256):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="verification")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.max_jobs = max_jobs
+        self.max_pending = max_pending
+        self.ttl_seconds = ttl_seconds
+
+    def submit(self, fn: Callable[[], Dict]) -> str:
+        """Schedule ``fn`` and return the job ID used to poll for its result"""
+        job_id = str(uuid.uuid4())
+        job = {
+            "job_id": job_id,
+            "status": "pending",
+            "result": None,
+            "error": None,
+            "created_at": time.time(),
+            "completed_at": None,
+            "done": threading.Event(),
+        }
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise JobQueueFull(f"{self._pending} verification jobs are already pending")
+            self._prune()
+            self._jobs[job_id] = job
+            self._pending += 1
+
+        def run():
+            try:
+                job["result"] = fn()
+                job["status"] = "completed"
+            except Exception as e:
+                job["error"] = str(e)
+                job["status"] = "failed"
+            finally:
+                job["completed_at"] = time.time()
+                with self._lock:
+                    self._pending -= 1
+                job["done"].set()
+
+        self._executor.submit(run)
+        return job_id
+
+    def get(self, job_id: str, wait: float = 0) -> Optional[Dict]:
+        """Return a snapshot of the job, optionally blocking up to ``wait`` seconds for it to finish"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        if wait > 0:
+            job["done"].wait(wait)
+        return {key: value for key, value in job.items() if key != "done"}
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl_seconds
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job["completed_at"] is not None and job["completed_at"] < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+        if len(self._jobs) < self.max_jobs:
+            return
+        # Oldest finished jobs first; pending ones are never dropped
+        finished = [job_id for job_id, job in self._jobs.items() if job["completed_at"] is not None]
+        for job_id in finished[:len(self._jobs) - self.max_jobs + 1]:
+            del self._jobs[job_id]
+        if len(self._jobs) >= self.max_jobs:
+            raise JobQueueFull(f"All {self.max_jobs} verification job slots hold unfinished jobs")